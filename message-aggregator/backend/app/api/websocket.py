@@ -1,22 +1,49 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List
+import asyncio
+import json
+import time
+from app.services.firebase_service import FirebaseService
+from app.services.push_hub import push_hub
 
 router = APIRouter()
 
-active_connections: List[WebSocket] = []
-
 @router.websocket("/ws/messages")
 async def websocket_endpoint(websocket: WebSocket):
+    """
+    Push channel for newly ingested messages.
+    Server frames: {"type": "messages" | "ping" | "resync" | "auth_ok", ...};
+    clients answer pings with {"type": "pong"} (any frame counts as activity).
+    
+    Shared platforms are pushed to every connection. To also receive your
+    own (e.g. Gmail) messages, send {"type": "auth", "token": <Firebase ID token>};
+    the user id comes from the verified token, never from the client.
+    """
     await websocket.accept()
-    active_connections.append(websocket)
+    conn = push_hub.register(websocket, None)
     try:
         while True:
             data = await websocket.receive_text()
-            # Here you can handle incoming messages if needed
-            await broadcast(data)
+            conn.last_seen = time.monotonic()
+            try:
+                frame = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(frame, dict):
+                continue
+            if frame.get('type') == 'ping':
+                conn.enqueue(json.dumps({'type': 'pong'}))
+            elif frame.get('type') == 'auth':
+                decoded_token = await asyncio.to_thread(FirebaseService.verify_token, frame.get('token') or '')
+                if not decoded_token:
+                    await websocket.close(code=1008)
+                    break
+                push_hub.set_user(conn, decoded_token['uid'])
+                conn.enqueue(json.dumps({'type': 'auth_ok'}))
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        pass
+    finally:
+        await push_hub.unregister(conn)
 
-async def broadcast(message: str):
-    for connection in active_connections:
-        await connection.send_text(message)
\ No newline at end of file
+@router.get("/ws/stats")
+async def websocket_stats():
+    return push_hub.stats()
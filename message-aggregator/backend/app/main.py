@@ -1,17 +1,31 @@
-from fastapi import FastAPI, HTTPException, Query, Body
+from fastapi import FastAPI, HTTPException, Query, Body, Depends
+from fastapi.security import HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
 from typing import List, Optional
 from dotenv import load_dotenv
-from app.services.aggregator import MessageAggregator
+from app.services.aggregator import MessageAggregator, AGGREGATION_DEADLINE
 from app.services.firebase_service import FirebaseService
 from app.services.gmail import get_oauth_flow, GmailService, CLIENT_ID, CLIENT_SECRET
 from app.services.discord_service import get_discord_service
+from app.services.telegram import get_telegram_service, close_telegram_service, API_ID, API_HASH
+from app.services.reddit import close_reddit_service
+from app.services.twitter import close_twitter_client
 from app.services.date_extractor import date_extractor  # ✅ Add this
+from app.services.curation import sentence_curator
+from app.services.worker_pool import curation_pool, extract_dates_and_times, WorkerPoolBusy
+from app.services.message_store import message_store
+from app.services.response_cache import response_cache
+from app.services.sync_state import sync_state
+from app.services.prefetch_scheduler import prefetch_scheduler
 from google.oauth2.credentials import Credentials
+from app.services.push_hub import push_hub
 from app.routes import user, calendar, saved_messages
+from app.middleware.auth import security, verify_firebase_token
+from app.api import websocket as websocket_api
 import os
 import json
+import asyncio
 
 load_dotenv()
 
@@ -30,6 +44,7 @@ app.add_middleware(
 app.include_router(user.router)
 app.include_router(calendar.router)
 app.include_router(saved_messages.router)  # ✅ Add this
+app.include_router(websocket_api.router)
 
 
 # Initialize aggregator
@@ -44,11 +59,65 @@ async def startup_event():
     print("🚀 Starting Discord bot...")
     await get_discord_service()
     print("✅ Discord bot initialized")
+    
+    # One Telegram connection for the app's lifetime
+    if API_ID and API_HASH:
+        await get_telegram_service()
+    
+    # CPU-bound curation runs in worker processes that preload the model;
+    # without workers, warm the model in this process instead
+    curation_pool.start()
+    if not curation_pool.enabled:
+        sentence_curator.start_background_load()
+
+    # Keep recently active users' feeds warm
+    prefetch_scheduler.start(aggregator)
+    
+    # WebSocket heartbeats and idle eviction
+    push_hub.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await prefetch_scheduler.stop()
+    await push_hub.stop()
+    await close_telegram_service()
+    await close_reddit_service()
+    await close_twitter_client()
+    curation_pool.shutdown()
 
 @app.get("/")
 async def root():
     return {"message": "Message Aggregator API is running"}
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: reports semantic model load state and load time"""
+    if curation_pool.enabled:
+        model_status = curation_pool.worker_model_status or {'state': 'loading', 'ready': False}
+        embedding_cache = {}
+    else:
+        model_status = sentence_curator.status()
+        embedding_cache = sentence_curator.cache_stats()
+    
+    ready = bool(model_status.get('ready'))
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "sentence_model": model_status,
+            "embedding_cache": embedding_cache,
+            "worker_pool": curation_pool.status()
+        }
+    )
+
+@app.post("/ready/retry-model")
+async def retry_model_load():
+    """Retry loading the semantic model after a failed load"""
+    if curation_pool.enabled:
+        raise HTTPException(status_code=409, detail="Model is loaded by the curation worker pool")
+    sentence_curator.start_background_load(retry=True)
+    return sentence_curator.status()
+
 # ✅ Add this new endpoint
 @app.post("/extract-dates")
 async def extract_dates(
@@ -60,7 +129,7 @@ async def extract_dates(
         # Combine title and text for extraction
         full_text = f"{title or ''}\n{text}"
         
-        dates_and_times = date_extractor.extract_dates_and_times(full_text)
+        dates_and_times = await curation_pool.run(extract_dates_and_times, full_text)
         
         # Group dates and times together if they're close
         grouped_events = []
@@ -128,15 +197,19 @@ async def extract_dates(
 async def get_messages(
     platforms: str = Query(..., description="Comma-separated list of platforms"),
     twitter_keyword: str = Query("python", description="Twitter search keyword"),
-    reddit_keyword: str = Query("technology", description="Reddit search keyword"),
-    reddit_subreddit: str = Query("all", description="Reddit subreddit"),
+    reddit_keyword: str = Query("technology", description="Reddit search keyword(s), comma-separated"),
+    reddit_subreddit: str = Query("all", description="Reddit subreddit(s), comma-separated"),
     limit: int = Query(20, description="Number of messages per platform"),
     filter_by_preferences: bool = Query(False, description="Filter by user preferences"),
-    user_id: Optional[str] = Query(None, description="Firebase user ID")
+    user_id: Optional[str] = Query(None, description="Firebase user ID"),
+    from_store: bool = Query(False, description="Serve from the local message store instead of upstream APIs"),
+    no_cache: bool = Query(False, description="Bypass the response cache"),
+    deadline: Optional[float] = Query(None, description="Seconds to wait for platforms before returning partial results")
 ):
     """Fetch messages from selected platforms"""
     try:
         selected_platforms = [p.strip() for p in platforms.split(',')]
+        generation = response_cache.generation(user_id)
         
         user_preferences = []
         if filter_by_preferences and user_id:
@@ -149,25 +222,181 @@ async def get_messages(
             else:
                 print(f"⚠️  No profile found for user {user_id}")
         
-        result = await aggregator.aggregate_messages_async(
-            selected_platforms=selected_platforms,
-            user_preferences=user_preferences if filter_by_preferences else None,
-            twitter_keyword=twitter_keyword,
-            reddit_keyword=reddit_keyword,
-            reddit_subreddit=reddit_subreddit,
-            limit=limit,
-            filter_by_preferences=filter_by_preferences,
-            user_id=user_id
-        )
+        def compute():
+            return aggregator.aggregate_messages_async(
+                selected_platforms=selected_platforms,
+                user_preferences=user_preferences if filter_by_preferences else None,
+                twitter_keyword=twitter_keyword,
+                reddit_keyword=reddit_keyword,
+                reddit_subreddit=reddit_subreddit,
+                limit=limit,
+                filter_by_preferences=filter_by_preferences,
+                user_id=user_id,
+                from_store=from_store,
+                deadline=deadline if deadline is not None else AGGREGATION_DEADLINE
+            )
+        
+        feed_params = {
+            'twitter_keyword': twitter_keyword,
+            'reddit_keyword': reddit_keyword,
+            'reddit_subreddit': reddit_subreddit,
+            'limit': limit,
+            'filter_by_preferences': filter_by_preferences,
+            'from_store': from_store
+        }
+        cache_key = response_cache.make_key(user_id, selected_platforms, user_preferences, **feed_params)
+        # Keep this feed warm in the background while the user is active
+        prefetch_scheduler.touch(user_id, selected_platforms, feed_params)
+        
+        if no_cache:
+            result = await compute()
+            if not result.get('partial'):
+                response_cache.put(cache_key, result, generation)
+            cache_status = 'bypass'
+        else:
+            result, cache_status = await response_cache.get_or_compute(cache_key, compute)
         
-        return result
+        print(f"🗄️  /messages cache: {cache_status}")
+        return {**result, 'cache_status': cache_status}
         
+    except WorkerPoolBusy as e:
+        print(f"⚠️  /messages rejected: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"❌ Error in /messages endpoint: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/messages/stream")
+async def stream_messages(
+    platforms: str = Query(..., description="Comma-separated list of platforms"),
+    twitter_keyword: str = Query("python", description="Twitter search keyword"),
+    reddit_keyword: str = Query("technology", description="Reddit search keyword(s), comma-separated"),
+    reddit_subreddit: str = Query("all", description="Reddit subreddit(s), comma-separated"),
+    limit: int = Query(20, description="Number of messages per platform"),
+    filter_by_preferences: bool = Query(False, description="Filter by user preferences"),
+    user_id: Optional[str] = Query(None, description="Firebase user ID"),
+    deadline: Optional[float] = Query(None, description="Seconds to wait for platforms before the final ranking"),
+    format: str = Query("ndjson", description="ndjson or sse")
+):
+    """
+    Stream /messages: one 'platform' event per platform as its fetch
+    finishes, then a 'curated' event with the ranked feed.
+    """
+    if format not in ('ndjson', 'sse'):
+        raise HTTPException(status_code=400, detail="format must be ndjson or sse")
+    
+    selected_platforms = [p.strip() for p in platforms.split(',')]
+    generation = response_cache.generation(user_id)
+    user_preferences = []
+    if filter_by_preferences and user_id:
+        profile = await asyncio.to_thread(FirebaseService.get_user_profile, user_id)
+        if profile and 'preferences' in profile:
+            user_preferences = profile['preferences']
+    
+    def encode(event: str, data: dict) -> str:
+        payload = json.dumps({'event': event, **data}, default=str)
+        if format == 'sse':
+            return f"event: {event}\ndata: {payload}\n\n"
+        return payload + "\n"
+    
+    async def events():
+        all_messages = []
+        platform_status = {}
+        try:
+            async for platform, status, messages in aggregator.iter_platforms(
+                selected_platforms, twitter_keyword, reddit_keyword, reddit_subreddit,
+                limit, user_id, deadline if deadline is not None else AGGREGATION_DEADLINE
+            ):
+                all_messages.extend(messages)
+                platform_status[platform] = status
+                yield encode('platform', {'platform': platform, 'status': status, 'messages': messages})
+            
+            result = await aggregator.finalize(
+                all_messages,
+                platform_status,
+                user_preferences if filter_by_preferences else None,
+                filter_by_preferences,
+                user_id
+            )
+            
+            # Same entry a plain /messages request would use
+            if not result.get('partial'):
+                response_cache.put(
+                    response_cache.make_key(
+                        user_id, selected_platforms, user_preferences,
+                        twitter_keyword=twitter_keyword,
+                        reddit_keyword=reddit_keyword,
+                        reddit_subreddit=reddit_subreddit,
+                        limit=limit,
+                        filter_by_preferences=filter_by_preferences,
+                        from_store=False
+                    ),
+                    result,
+                    generation
+                )
+            yield encode('curated', result)
+        except WorkerPoolBusy as e:
+            yield encode('error', {'status_code': 503, 'detail': str(e)})
+        except Exception as e:
+            print(f"❌ Error in /messages/stream: {e}")
+            yield encode('error', {'status_code': 500, 'detail': str(e)})
+    
+    media_type = 'text/event-stream' if format == 'sse' else 'application/x-ndjson'
+    return StreamingResponse(
+        events(),
+        media_type=media_type,
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.get("/messages/search")
+async def search_messages(
+    q: str = Query(..., description="Full-text search query"),
+    platforms: Optional[str] = Query(None, description="Comma-separated list of platforms"),
+    limit: int = Query(50, description="Maximum number of results"),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Search stored message history (shared platforms + the caller's own) without touching upstream APIs"""
+    user_data = await verify_firebase_token(credentials)
+    user_id = user_data['uid']
+    try:
+        selected_platforms = [p.strip() for p in platforms.split(',')] if platforms else None
+        messages = await asyncio.to_thread(
+            message_store.search, q, selected_platforms, limit, user_id
+        )
+        return {"messages": messages, "count": len(messages)}
+    except Exception as e:
+        print(f"❌ Error in /messages/search endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/messages/gmail/{message_id}/body")
+async def get_gmail_body(
+    message_id: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Full body of a Gmail message listed with only its snippet (the caller's own mailbox)"""
+    user_data = await verify_firebase_token(credentials)
+    user_id = user_data['uid']
+    try:
+        if not message_id.startswith('gmail_'):
+            message_id = f"gmail_{message_id}"
+        
+        message = await asyncio.to_thread(message_store.get_message, message_id, user_id)
+        if message is None:
+            message = {'id': message_id, 'gmail_id': message_id[len('gmail_'):], 'platform': 'gmail', 'body_loaded': False}
+        
+        if message.get('body_loaded') is False:
+            if not await aggregator.load_gmail_bodies([message], user_id):
+                raise HTTPException(status_code=404, detail="Gmail message body not available")
+        
+        return {"id": message_id, "content": message.get('content', ''), "body_loaded": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in /messages/gmail body endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/user/preferences")
 async def save_preferences(user_id: str, preferences: List[str]):
     """Save user preferences to Firebase"""
@@ -175,6 +404,7 @@ async def save_preferences(user_id: str, preferences: List[str]):
         FirebaseService.update_user_profile(user_id, {
             'preferences': preferences
         })
+        response_cache.invalidate(user_id)
         return {"message": "Preferences saved successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -246,6 +476,10 @@ async def gmail_callback(
         gmail_credentials_store[user_id] = credentials
         FirebaseService.save_user_credentials(user_id, 'gmail', creds_dict)
         
+        # New account: drop cached feeds and restart Gmail sync from scratch
+        response_cache.invalidate(user_id)
+        sync_state.reset(user_id, 'gmail')
+        
         print(f"✅ Gmail credentials saved for user {user_id}")
         
         return RedirectResponse(url="http://localhost:5173/?gmail=success")
@@ -4,6 +4,9 @@ from pydantic import BaseModel
 from typing import List, Optional
 from app.middleware.auth import security, verify_firebase_token
 from app.services.firebase_service import FirebaseService
+from app.services.response_cache import response_cache
+from app.services.sync_state import sync_state
+from app.services.prefetch_scheduler import prefetch_scheduler
 
 router = APIRouter(prefix="/api/user", tags=["user"])
 
@@ -32,6 +35,8 @@ async def setup_user(
     })
     
     if success:
+        response_cache.invalidate(uid)
+        prefetch_scheduler.prefetch_now(uid, min_age=0)
         return {"message": "User setup completed"}
     raise HTTPException(status_code=500, detail="Failed to save user setup")
 
@@ -50,6 +55,8 @@ async def save_credentials(
     )
     
     if success:
+        response_cache.invalidate(uid)
+        sync_state.reset(uid, creds_data.platform)
         return {"message": f"Credentials saved for {creds_data.platform}"}
     raise HTTPException(status_code=500, detail="Failed to save credentials")
 
@@ -62,6 +69,8 @@ async def get_profile(
     
     profile = FirebaseService.get_user_profile(uid)
     if profile:
+        # Dashboard loads the profile right after login: warm the feed now
+        prefetch_scheduler.prefetch_now(uid)
         return profile
     raise HTTPException(status_code=404, detail="User profile not found")
 
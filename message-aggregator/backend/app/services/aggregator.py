@@ -1,18 +1,47 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple, AsyncIterator
 from app.services.telegram import fetch_telegram_messages
 from app.services.twitter import fetch_twitter_messages
-from app.services.gmail import fetch_gmail_messages
+from app.services.gmail import fetch_gmail_messages, load_gmail_bodies
 from app.services.reddit import fetch_reddit_messages
 from app.services.slack import fetch_slack_messages
 from app.services.discord_service import fetch_discord_messages
-from app.services.message_filter import MessageFilter
 from app.services.firebase_service import FirebaseService
-from app.services.curation.hybrid_curator import HybridContentCurator
+from app.services.worker_pool import curation_pool, run_curation
+from app.services.message_store import message_store
+from app.services.push_hub import push_hub
+from collections import OrderedDict
 import asyncio
+import json
+import os
+import time
+
+# Platforms whose messages belong to a single user's account
+PRIVATE_PLATFORMS = {'gmail'}
+
+# Seconds a feed request waits for upstream platforms before curating what has arrived
+AGGREGATION_DEADLINE = float(os.getenv('AGGREGATION_DEADLINE', '6'))
+# Hard per-platform limit; a fetch still running after the deadline keeps going until this
+DEFAULT_PLATFORM_TIMEOUTS = {
+    'telegram': 20,
+    'twitter': 10,
+    'gmail': 20,
+    'reddit': 15,
+    'slack': 30,
+    'discord': 10,
+}
+PLATFORM_TIMEOUTS = {**DEFAULT_PLATFORM_TIMEOUTS, **json.loads(os.getenv('PLATFORM_TIMEOUTS', '{}'))}
+# A fetch that finished after its request's deadline is used by the next request within this window
+LATE_RESULT_TTL = float(os.getenv('LATE_RESULT_TTL', '120'))
+LATE_RESULT_MAX_ENTRIES = int(os.getenv('LATE_RESULT_MAX_ENTRIES', '256'))
 
 class MessageAggregator:
     def __init__(self):
-        self.curator = HybridContentCurator()
+        # CPU-bound filtering/curation runs in worker processes, off the event loop
+        self.pool = curation_pool
+        # Upstream fetches by job key, shared by concurrent requests
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        # job key -> (finished at, messages) for fetches nobody consumed yet, oldest first
+        self._late_results: "OrderedDict[tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
     
     async def aggregate_messages_async(
         self,
@@ -23,8 +52,16 @@ class MessageAggregator:
         reddit_subreddit: str = "all",
         limit: int = 20,
         filter_by_preferences: bool = False,
-        user_id: Optional[str] = None
+        user_id: Optional[str] = None,
+        from_store: bool = False,
+        deadline: Optional[float] = AGGREGATION_DEADLINE
     ) -> Dict[str, Any]:
+        """
+        Fetch, filter and curate messages.
+        With from_store=True the messages come from the local message store
+        instead of the upstream platform APIs. Platforms that haven't answered
+        by the deadline are left out and reported in platform_status.
+        """
         if selected_platforms is None:
             selected_platforms = ['telegram', 'twitter', 'gmail', 'reddit', 'slack', 'discord']
         
@@ -32,66 +69,252 @@ class MessageAggregator:
         if filter_by_preferences and user_preferences:
             print(f"🎯 Filtering by preferences: {user_preferences}")
         
-        tasks = []
-        platform_names = []
+        if from_store:
+            all_messages = await asyncio.to_thread(
+                message_store.recent_messages, selected_platforms, limit, user_id
+            )
+            platform_status = {platform: 'store' for platform in selected_platforms}
+            print(f"📦 Loaded {len(all_messages)} messages from the local store")
+        else:
+            all_messages, platform_status = await self.fetch_platforms(
+                selected_platforms, twitter_keyword, reddit_keyword,
+                reddit_subreddit, limit, user_id, deadline
+            )
         
-        # Telegram (sync -> thread)
-        if 'telegram' in selected_platforms:
-            tasks.append(asyncio.to_thread(fetch_telegram_messages, limit))
-            platform_names.append('telegram')
+        return await self.finalize(
+            all_messages, platform_status, user_preferences, filter_by_preferences, user_id
+        )
+    
+    async def finalize(
+        self,
+        all_messages: List[Dict[str, Any]],
+        platform_status: Dict[str, str],
+        user_preferences: Optional[List[str]],
+        filter_by_preferences: bool,
+        user_id: Optional[str]
+    ) -> Dict[str, Any]:
+        """Curate fetched messages into the /messages response"""
+        result = await self._curate(all_messages, user_preferences, filter_by_preferences)
+        result['platform_status'] = platform_status
+        # Only late platforms make a response partial: their results arrive for the next call
+        result['partial'] = 'late' in platform_status.values()
         
-        # Twitter (sync -> thread)
-        if 'twitter' in selected_platforms:
-            tasks.append(asyncio.to_thread(fetch_twitter_messages, twitter_keyword, limit))
-            platform_names.append('twitter')
+        # Gmail is listed as metadata + snippet; important messages get their full body
+        await self.load_gmail_bodies(result['important'], user_id)
+        return result
+    
+    async def fetch_platforms(
+        self,
+        selected_platforms: List[str],
+        twitter_keyword: str,
+        reddit_keyword: str,
+        reddit_subreddit: str,
+        limit: int,
+        user_id: Optional[str],
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Fetch from upstream APIs concurrently and upsert into the local store.
+        Returns (messages in platform order, status per platform).
+        """
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        platform_status: Dict[str, str] = {}
         
-        # Gmail (sync -> thread)
-        if 'gmail' in selected_platforms:
-            credentials = FirebaseService.get_user_credentials(user_id, 'gmail') if user_id else None
-            tasks.append(asyncio.to_thread(fetch_gmail_messages, limit, credentials))
-            platform_names.append('gmail')
+        async for platform, status, messages in self.iter_platforms(
+            selected_platforms, twitter_keyword, reddit_keyword,
+            reddit_subreddit, limit, user_id, deadline
+        ):
+            results[platform] = messages
+            platform_status[platform] = status
         
-        # Reddit (sync -> thread)
-        if 'reddit' in selected_platforms:
-            tasks.append(asyncio.to_thread(fetch_reddit_messages, reddit_keyword, reddit_subreddit, limit))
-            platform_names.append('reddit')
+        all_messages = [msg for platform in selected_platforms for msg in results.get(platform, [])]
+        print(f"📊 Total messages fetched: {len(all_messages)}")
+        return all_messages, platform_status
+    
+    async def iter_platforms(
+        self,
+        selected_platforms: List[str],
+        twitter_keyword: str,
+        reddit_keyword: str,
+        reddit_subreddit: str,
+        limit: int,
+        user_id: Optional[str],
+        deadline: Optional[float] = None
+    ) -> AsyncIterator[Tuple[str, str, List[Dict[str, Any]]]]:
+        """
+        Yield (platform, status, messages) as each platform finishes.
+        Status is ok, late (still running at the deadline), timeout (hit its
+        platform timeout) or failed. Late fetches keep running; their results
+        are stored and handed to the next request. Without a deadline, waits
+        for every platform.
+        """
+        jobs = self._platform_jobs(twitter_keyword, reddit_keyword, reddit_subreddit, limit, user_id)
+        ends_at = time.monotonic() + deadline if deadline is not None else None
+        pending: Dict[asyncio.Task, str] = {}
         
-        # Slack (sync -> thread)
-        if 'slack' in selected_platforms:
-            tasks.append(asyncio.to_thread(fetch_slack_messages, limit))
-            platform_names.append('slack')
+        for platform in selected_platforms:
+            if platform not in jobs:
+                continue
+            key, fetch = jobs[platform]
+            late = self._late_results.pop(key, None)
+            if late is not None and time.monotonic() - late[0] < LATE_RESULT_TTL:
+                # Finished after an earlier request's deadline
+                print(f"♻️  {platform}: using {len(late[1])} messages from a late fetch")
+                yield platform, 'ok', late[1]
+                continue
+            pending[self._start_fetch(platform, key, fetch, user_id)] = platform
         
-        # Discord (already async)
-        if 'discord' in selected_platforms:
-            tasks.append(fetch_discord_messages(limit))
-            platform_names.append('discord')
+        while pending:
+            timeout = None if ends_at is None else max(0.0, ends_at - time.monotonic())
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                platform = pending.pop(task)
+                status, messages = self._fetch_outcome(platform, task)
+                if status == 'ok':
+                    self._late_results.pop(jobs[platform][0], None)
+                yield platform, status, messages
         
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for platform in pending.values():
+            print(f"⏰ {platform}: not done by the {deadline}s deadline")
+            yield platform, 'late', []
+    
+    @staticmethod
+    def _fetch_outcome(platform: str, task: asyncio.Task) -> Tuple[str, List[Dict[str, Any]]]:
+        if task.cancelled():
+            return 'failed', []
+        error = task.exception()
+        if error is not None:
+            print(f"❌ Error fetching {platform} messages: {error!r}")
+            return ('timeout' if isinstance(error, asyncio.TimeoutError) else 'failed'), []
+        print(f"✅ {platform}: {len(task.result())} messages")
+        return 'ok', task.result()
+    
+    def _platform_jobs(
+        self,
+        twitter_keyword: str,
+        reddit_keyword: str,
+        reddit_subreddit: str,
+        limit: int,
+        user_id: Optional[str]
+    ) -> Dict[str, Tuple[tuple, Callable[[], Awaitable[List[Dict[str, Any]]]]]]:
+        """Per platform: (job key, coroutine factory)"""
+        return {
+            # Telegram (async, shared connection)
+            'telegram': (('telegram', limit), lambda: fetch_telegram_messages(limit)),
+            # Twitter (async, pooled client)
+            'twitter': (('twitter', twitter_keyword, limit), lambda: fetch_twitter_messages(twitter_keyword, limit)),
+            # Gmail (sync -> thread)
+            'gmail': (('gmail', user_id, limit), lambda: asyncio.to_thread(self._fetch_gmail, limit, user_id)),
+            # Reddit (async, shared session)
+            'reddit': (
+                ('reddit', reddit_keyword, reddit_subreddit, limit),
+                lambda: fetch_reddit_messages(reddit_keyword, reddit_subreddit, limit)
+            ),
+            # Slack (async)
+            'slack': (('slack', limit), lambda: fetch_slack_messages(limit)),
+            # Discord (already async)
+            'discord': (('discord', limit), lambda: fetch_discord_messages(limit)),
+        }
+    
+    @staticmethod
+    def _fetch_gmail(limit: int, user_id: Optional[str]) -> List[Dict[str, Any]]:
+        credentials = FirebaseService.get_user_credentials(user_id, 'gmail') if user_id else None
+        return fetch_gmail_messages(limit, credentials, user_id)
+    
+    def _start_fetch(
+        self,
+        platform: str,
+        key: tuple,
+        fetch: Callable[[], Awaitable[List[Dict[str, Any]]]],
+        user_id: Optional[str]
+    ) -> asyncio.Task:
+        """Start (or join) the upstream fetch for key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run_fetch(platform, key, fetch, user_id))
+            # May finish with nobody awaiting it
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+    
+    async def _run_fetch(
+        self,
+        platform: str,
+        key: tuple,
+        fetch: Callable[[], Awaitable[List[Dict[str, Any]]]],
+        user_id: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        try:
+            messages = await asyncio.wait_for(fetch(), PLATFORM_TIMEOUTS.get(platform, 30))
+            await self._store_messages(platform, messages, user_id)
+            # Kept for the next request in case this one's deadline has passed
+            self._keep_late_result(key, messages)
+            return messages
+        finally:
+            self._inflight.pop(key, None)
+    
+    def _keep_late_result(self, key: tuple, messages: List[Dict[str, Any]]):
+        """Store a finished fetch, dropping expired entries and the oldest beyond the cap"""
+        now = time.monotonic()
+        self._late_results.pop(key, None)
+        self._late_results[key] = (now, messages)
+        while self._late_results:
+            finished_at, _ = next(iter(self._late_results.values()))
+            if now - finished_at < LATE_RESULT_TTL and len(self._late_results) <= LATE_RESULT_MAX_ENTRIES:
+                break
+            self._late_results.popitem(last=False)
+    
+    async def load_gmail_bodies(self, messages: List[Dict[str, Any]], user_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Load full bodies (one batch request) for Gmail messages that only have a snippet"""
+        if not user_id or not any(
+            msg.get('platform') == 'gmail' and msg.get('body_loaded') is False for msg in messages
+        ):
+            return []
         
-        all_messages = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                print(f"❌ Error fetching {platform_names[i]} messages: {result}")
-            elif isinstance(result, list):
-                all_messages.extend(result)
-                print(f"✅ {platform_names[i]}: {len(result)} messages")
+        credentials = await asyncio.to_thread(FirebaseService.get_user_credentials, user_id, 'gmail')
+        updated = await asyncio.to_thread(load_gmail_bodies, messages, credentials, user_id)
+        await self._store_messages('gmail', updated, user_id)
+        return updated
+    
+    async def _store_messages(self, platform: str, messages: List[Dict[str, Any]], user_id: Optional[str]):
+        """
+        Upsert fetched messages (Gmail is private to the user, the rest is
+        shared) and push the ones not seen before to WebSocket clients.
+        The first fill of an empty store is history, not news: nothing is pushed.
+        """
+        owner = user_id if platform in PRIVATE_PLATFORMS else None
         
-        print(f"📊 Total messages fetched: {len(all_messages)}")
+        def store():
+            warm = message_store.has_messages(platform, owner)
+            return warm, message_store.upsert_new_messages(messages, owner)
         
-        if filter_by_preferences and user_preferences:
-            print(f"🔍 Applying preference filter with {len(user_preferences)} preferences")
-            mf = MessageFilter()
-            filtered = mf.filter_important_messages(
+        try:
+            warm, new_messages = await asyncio.to_thread(store)
+        except Exception as e:
+            print(f"⚠️  Error storing {platform} messages: {e}")
+            return
+        if warm:
+            push_hub.publish_messages(new_messages, owner)
+    
+    async def _curate(
+        self,
+        all_messages: List[Dict[str, Any]],
+        user_preferences: Optional[List[str]],
+        filter_by_preferences: bool
+    ) -> Dict[str, Any]:
+        """Preference filtering + curation in the worker pool"""
+        if user_preferences and all_messages:
+            curated_result = await self.pool.run(
+                run_curation,
                 all_messages,
                 user_preferences,
-                threshold=0.15,
-                top_k=None
+                bool(filter_by_preferences)
             )
-            all_messages = filtered['important'] + filtered['regular']
-            print(f"✅ After filtering: {len(all_messages)} messages")
-        
-        print("🎨 Starting message curation...")
-        curated_result = self.curator.curate_messages(all_messages, user_preferences or [])
+        else:
+            # Nothing to score: skip the round trip to the worker pool
+            curated_result = {'important': [], 'regular': all_messages, 'curation_stats': {}}
         
         important_messages = curated_result['important']
         regular_messages = curated_result['regular']
@@ -103,9 +326,9 @@ class MessageAggregator:
         return {
             'important': important_messages,
             'regular': regular_messages,
-            'total_count': len(all_messages),
+            'total_count': curated_result.get('total_count', len(all_messages)),
             'important_count': len(important_messages),
             'preferences_used': user_preferences or [],
-            'curation_method': 'hybrid',
+            'curation_method': curated_result.get('curation_method', 'hybrid'),
             'curation_stats': curated_result.get('curation_stats', {})
         }
\ No newline at end of file
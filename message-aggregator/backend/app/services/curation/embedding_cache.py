@@ -0,0 +1,249 @@
+from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import os
+import re
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'EMBEDDING_CACHE_DIR',
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', '.cache', 'embeddings')
+)
+DEFAULT_MEMORY_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MEMORY_ENTRIES', '5000'))
+DEFAULT_DISK_ENTRIES = int(os.getenv('EMBEDDING_CACHE_DISK_ENTRIES', '50000'))
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with two tiers:
+    - in-memory LRU of recently used vectors
+    - on-disk ring of fixed-width float32 vectors, memory-mapped
+
+    Keys are a hash of the model name and the normalized message text,
+    so the same message seen on a later refresh never hits the model again.
+    
+    The disk tier can be shared by several worker processes: writes take a
+    file lock and every slot stores its key digest, so a slot overwritten
+    by another process is detected and treated as a miss. The digest file
+    doubles as the index: a shared write counter tells each process which
+    slots changed since it last looked, and only those are re-read.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        dimension: int,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        max_disk_entries: int = DEFAULT_DISK_ENTRIES
+    ):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        # Disk tier: key -> slot index, rebuilt from the digest file
+        self._disk_index: Dict[str, int] = {}
+        # Total slot writes (shared counter) already reflected in _disk_index
+        self._synced_writes = 0
+        self._vectors = None
+        self._digests = None
+        self._writes = None
+
+        if max_disk_entries > 0:
+            self._open_disk_tier(cache_dir)
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Normalize whitespace and case so trivial differences share a key"""
+        return re.sub(r'\s+', ' ', text).strip().lower()
+
+    def make_key(self, text: str) -> str:
+        """Content-addressed key for a text under this model"""
+        payload = f"{self.model_name}\0{self.normalize_text(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up vectors for texts; None marks a miss"""
+        results = []
+        with self._lock:
+            self._sync_disk_index()
+            for text in texts:
+                results.append(self._get(self.make_key(text)))
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Store freshly computed vectors in both tiers"""
+        if len(texts) == 0:
+            return
+
+        with self._lock, self._file_lock():
+            # Pick up slots written by other processes before claiming new ones
+            self._sync_disk_index()
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                self._write_disk(key, vector)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current tier sizes"""
+        with self._lock:
+            lookups = sum(self._stats.values())
+            hits = self._stats['memory_hits'] + self._stats['disk_hits']
+            return {
+                **self._stats,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._disk_index),
+                'max_disk_entries': self.max_disk_entries,
+                'disk_bytes': self.max_disk_entries * self.dimension * 4 if self._vectors is not None else 0
+            }
+
+    def clear(self):
+        """Drop every cached vector"""
+        with self._lock, self._file_lock():
+            self._memory.clear()
+            self._disk_index.clear()
+            self._synced_writes = 0
+            if self._vectors is not None:
+                self._digests[:] = 0
+                self._writes[0] = 0
+
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self._stats['memory_hits'] += 1
+            return vector
+
+        slot = self._disk_index.get(key)
+        if slot is not None and self._vectors is not None:
+            if self._digests[slot].tobytes() == bytes.fromhex(key):
+                vector = np.array(self._vectors[slot])
+                self._remember(key, vector)
+                self._stats['disk_hits'] += 1
+                return vector
+            # Slot was reused by another process since our index was loaded
+            self._disk_index.pop(key, None)
+
+        self._stats['misses'] += 1
+        return None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _open_disk_tier(self, cache_dir: str):
+        """Map the vector, digest and counter files and build the slot index"""
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', self.model_name)
+            base = os.path.join(cache_dir, f"{safe_name}_{self.dimension}")
+            self._vectors_path = f"{base}.f32"
+            self._digests_path = f"{base}.keys"
+            self._writes_path = f"{base}.writes"
+            self._lock_path = f"{base}.lock"
+
+            with self._file_lock():
+                mode = 'r+'
+                expected_sizes = (
+                    (self._vectors_path, self.max_disk_entries * self.dimension * 4),
+                    (self._digests_path, self.max_disk_entries * 32),
+                    (self._writes_path, 8),
+                )
+                for path, size in expected_sizes:
+                    # Missing file or capacity changed: start over rather than misread slots
+                    if not os.path.exists(path) or os.path.getsize(path) != size:
+                        mode = 'w+'
+
+                self._vectors = np.memmap(
+                    self._vectors_path, dtype=np.float32, mode=mode,
+                    shape=(self.max_disk_entries, self.dimension)
+                )
+                self._digests = np.memmap(
+                    self._digests_path, dtype=np.uint8, mode=mode,
+                    shape=(self.max_disk_entries, 32)
+                )
+                self._writes = np.memmap(self._writes_path, dtype=np.int64, mode=mode, shape=(1,))
+                self._rebuild_disk_index()
+
+            print(f"✅ Embedding cache ready: {len(self._disk_index)} vectors on disk")
+        except Exception as e:
+            print(f"⚠️  Embedding disk cache unavailable, using memory only: {e}")
+            self._vectors = None
+            self._digests = None
+            self._writes = None
+
+    def _rebuild_disk_index(self):
+        """Full scan of the digest file (on open, or after falling a whole ring behind)"""
+        self._synced_writes = int(self._writes[0])
+        occupied = np.flatnonzero(self._digests.any(axis=1))
+        self._disk_index = {self._digests[slot].tobytes().hex(): int(slot) for slot in occupied}
+
+    def _sync_disk_index(self):
+        """Index only the slots other processes wrote since our last look"""
+        if self._vectors is None:
+            return
+        writes = int(self._writes[0])
+        if writes == self._synced_writes:
+            return
+        if writes < self._synced_writes or writes - self._synced_writes >= self.max_disk_entries:
+            # Cleared, or every slot was rewritten
+            self._rebuild_disk_index()
+            return
+        for count in range(self._synced_writes, writes):
+            self._index_slot(count % self.max_disk_entries)
+        self._synced_writes = writes
+
+    def _index_slot(self, slot: int):
+        """Point the index at whatever key slot now holds"""
+        digest = self._digests[slot].tobytes()
+        if any(digest):
+            self._disk_index[digest.hex()] = slot
+
+    @contextmanager
+    def _file_lock(self):
+        """Cross-process lock around disk tier writes (no-op without fcntl)"""
+        if fcntl is None or not getattr(self, '_lock_path', None):
+            yield
+            return
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_disk(self, key: str, vector: np.ndarray):
+        if self._vectors is None or key in self._disk_index:
+            return
+
+        # Ring buffer: overwrite the oldest slot once the file is full
+        writes = int(self._writes[0])
+        slot = writes % self.max_disk_entries
+        evicted = self._digests[slot].tobytes()
+        if any(evicted) and self._disk_index.get(evicted.hex()) == slot:
+            del self._disk_index[evicted.hex()]
+
+        # Digest last, so readers never match a half-written vector
+        self._digests[slot] = 0
+        self._vectors[slot] = vector
+        self._digests[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        self._writes[0] = writes + 1
+        self._disk_index[key] = slot
+        if self._synced_writes == writes:
+            self._synced_writes = writes + 1
@@ -1,6 +1,9 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 from ..message_filter import message_filter
 from .sentence_transformer_curator import sentence_curator
+from ..keyword_matcher import KeywordMatcher, get_keyword_matcher
+from ..message_features import MessageFeatures
 
 class HybridContentCurator:
     """
@@ -23,7 +26,8 @@ class HybridContentCurator:
         messages: List[Dict[str, Any]],
         preferences: List[str],
         threshold: float = 0.25,
-        top_k: int = 30
+        top_k: int = 30,
+        features: Optional[List[MessageFeatures]] = None
     ) -> Dict[str, Any]:
         """
         Advanced content curation pipeline:
@@ -31,6 +35,9 @@ class HybridContentCurator:
         2. Semantic similarity (Sentence Transformers)
         3. Keyword bonus scoring
         4. Hybrid score combination
+        
+        `features` are the shared records from MessageFilter.extract_features
+        (same order as `messages`); when given, nothing is rescored.
         """
         if not preferences or not messages:
             return {
@@ -43,35 +50,58 @@ class HybridContentCurator:
         print(f"   Messages: {len(messages)}")
         print(f"   Preferences: {preferences}")
         
-        scored_messages = []
-        
-        for msg in messages:
-            # Step 1: TF-IDF Score
-            tfidf_score = message_filter.calculate_importance_score(
-                msg, 
+        # Step 1: TF-IDF + keyword features, computed once per message
+        # (reused as-is when the caller already ran the preference filter)
+        if features is None:
+            features = message_filter.extract_features(
+                messages,
                 preferences,
                 keyword_weight=0.7,
                 tfidf_weight=0.3
             )
-            
-            # Step 2: Semantic Similarity Score
-            semantic_score = sentence_curator.calculate_semantic_similarity(
-                msg,
+        
+        # Step 2: Semantic similarity for all messages in one batched encode.
+        # Until the model is warm, fall back to TF-IDF + keywords only
+        semantic_ready = sentence_curator.is_ready
+        if not semantic_ready:
+            print(f"⏳ Semantic model {sentence_curator.load_state}, using keyword/TF-IDF scoring")
+            sentence_curator.start_background_load()
+        
+        pending = [f for f in features if f.semantic_score is None]
+        if pending and semantic_ready:
+            semantic_scores = sentence_curator.calculate_text_similarity(
+                [f.raw_text for f in pending],
                 preferences
-            )
+            )[:, 0]
+            for feature, semantic_score in zip(pending, semantic_scores):
+                feature.semantic_score = float(semantic_score)
+        
+        scored_messages = []
+        
+        for feature in features:
+            tfidf_score = feature.importance_score
             
             # Step 3: Keyword Bonus (exact matches get boost)
-            keyword_bonus = self._calculate_keyword_bonus(msg, preferences)
+            keyword_bonus = self._calculate_keyword_bonus(feature, preferences)
             
             # Step 4: Hybrid Score
-            hybrid_score = (
-                (self.tfidf_weight * tfidf_score) +
-                (self.semantic_weight * semantic_score) +
-                keyword_bonus
-            )
+            if feature.semantic_score is not None:
+                semantic_score = feature.semantic_score
+                hybrid_score = (
+                    (self.tfidf_weight * tfidf_score) +
+                    (self.semantic_weight * semantic_score) +
+                    keyword_bonus
+                )
+            else:
+                # Lexical fallback: TF-IDF takes the semantic weight too
+                semantic_score = 0.0
+                hybrid_score = (
+                    ((self.tfidf_weight + self.semantic_weight) * tfidf_score) +
+                    keyword_bonus
+                )
             
             # Store all scores
-            msg_copy = msg.copy()
+            msg_copy = feature.message.copy()
             msg_copy['tfidf_score'] = tfidf_score
             msg_copy['semantic_score'] = semantic_score
             msg_copy['keyword_bonus'] = keyword_bonus
@@ -80,26 +110,18 @@ class HybridContentCurator:
             
             scored_messages.append(msg_copy)
         
-        # Sort by hybrid score
-        scored_messages.sort(key=lambda x: x['hybrid_score'], reverse=True)
-        
-        # Split into important and regular
-        important = []
-        regular = []
-        
-        for msg in scored_messages:
-            if msg['hybrid_score'] >= threshold:
-                important.append(msg)
-            else:
-                regular.append(msg)
-        
-        # Limit important messages
-        if top_k and len(important) > top_k:
-            regular = important[top_k:] + regular
-            important = important[:top_k]
+        # Split into important and regular (partial sort for top_k)
+        important_idx, regular_idx = self._rank_scores(
+            np.array([m['hybrid_score'] for m in scored_messages], dtype=np.float64),
+            threshold,
+            top_k
+        )
+        important = [scored_messages[i] for i in important_idx]
+        regular = [scored_messages[i] for i in regular_idx]
         
         # Calculate statistics
         stats = self._calculate_curation_stats(important, regular, preferences)
+        stats['embedding_cache'] = sentence_curator.cache_stats()
         
         print(f"\n📊 Curation Results:")
         print(f"   Important: {len(important)} messages")
@@ -113,25 +135,57 @@ class HybridContentCurator:
         return {
             'important': important,
             'regular': regular,
-            'curation_stats': stats
+            'curation_stats': stats,
+            'curation_method': 'hybrid' if semantic_ready else 'lexical'
         }
     
+    @staticmethod
+    def _rank_scores(
+        scores: np.ndarray,
+        threshold: float,
+        top_k: Optional[int]
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Return (important, regular) indices, both ordered by descending score.
+        Only the top_k candidates are selected with argpartition; ties keep
+        input order, matching a stable descending sort.
+        """
+        order = np.arange(len(scores))
+        above = order[scores >= threshold]
+        below = order[scores < threshold]
+        
+        if top_k and len(above) > top_k:
+            # Partial sort: pick the k best without ordering the rest
+            part = np.argpartition(-scores[above], top_k - 1)
+            kth_score = scores[above[part[top_k - 1]]]
+            # Resolve ties at the cut-off by input order
+            better = above[scores[above] > kth_score]
+            tied = above[scores[above] == kth_score]
+            selected = np.concatenate([better, tied[:top_k - len(better)]])
+            overflow = np.setdiff1d(above, selected, assume_unique=True)
+            important = selected[np.argsort(-scores[selected], kind='stable')]
+            rest = np.concatenate([overflow, below])
+        else:
+            important = above[np.argsort(-scores[above], kind='stable')]
+            rest = below
+        
+        rest = rest[np.lexsort((rest, -scores[rest]))]
+        return important.tolist(), rest.tolist()
+    
+    @staticmethod
+    def _preference_matcher(preferences: List[str]) -> KeywordMatcher:
+        """Compiled matcher for the exact preference phrases"""
+        return get_keyword_matcher(tuple(sorted({pref.lower() for pref in preferences})))
+    
     def _calculate_keyword_bonus(
         self,
-        message: Dict[str, Any],
+        feature: MessageFeatures,
         preferences: List[str]
     ) -> float:
         """Give bonus for exact keyword matches"""
-        message_text = ' '.join([
-            str(message.get('title', '')),
-            str(message.get('content', '')),
-            str(message.get('sender', '')),
-            str(message.get('chat', ''))
-        ]).lower()
-        
         bonus = 0.0
         for pref in preferences:
-            if pref.lower() in message_text:
+            if feature.has_term(pref.lower()):
                 bonus += self.keyword_bonus
         
         return min(bonus, 0.5)  # Cap at 0.5
@@ -159,12 +213,19 @@ class HybridContentCurator:
         avg_hybrid = sum(m.get('hybrid_score', 0) for m in important) / len(important)
         
         # Count preference matches
+        matcher = self._preference_matcher(preferences)
+        matched_per_message = []
+        for m in important:
+            content_hits = matcher.count(str(m.get('content', '')).lower())
+            title_hits = matcher.count(str(m.get('title', '')).lower())
+            matched_per_message.append(content_hits.keys() | title_hits.keys())
+        
         preferences_matched = {}
         for pref in preferences:
+            pref_lower = pref.lower()
             count = sum(
-                1 for m in important 
-                if pref.lower() in str(m.get('content', '')).lower() or
-                   pref.lower() in str(m.get('title', '')).lower()
+                1 for matched in matched_per_message
+                if not pref_lower or pref_lower in matched
             )
             if count > 0:
                 preferences_matched[pref] = count
@@ -0,0 +1,305 @@
+from typing import List, Dict, Any, Optional, Tuple, Union
+from contextlib import contextmanager
+import json
+import os
+import re
+import time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+DEFAULT_EXPORT_DIR = os.getenv(
+    'ONNX_EXPORT_DIR',
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', '.cache', 'onnx')
+)
+
+
+def _model_dir(model_name: str, export_dir: str) -> str:
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+    return os.path.join(export_dir, safe_name)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Cross-process lock so concurrently starting workers export only once (no-op without fcntl)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_onnx_model(model_name: str, export_dir: str = DEFAULT_EXPORT_DIR) -> str:
+    """
+    Export the transformer of a sentence-transformers model to ONNX (fp32).
+    Tokenizer and pooling config are saved next to it, so inference needs
+    only onnxruntime + the tokenizer. No-op if the export already exists.
+    """
+    model_dir = _model_dir(model_name, export_dir)
+    onnx_path = os.path.join(model_dir, 'model.onnx')
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    os.makedirs(model_dir, exist_ok=True)
+    with _file_lock(os.path.join(model_dir, 'export.lock')):
+        # Another worker may have finished the export while we waited
+        if not os.path.exists(onnx_path):
+            _export(model_name, model_dir, onnx_path)
+    return onnx_path
+
+
+def _export(model_name: str, model_dir: str, onnx_path: str):
+    """Run the export (caller holds the export lock)"""
+    # Heavy imports only for the one-time export
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    print(f"🔄 Exporting {model_name} to ONNX...")
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    dummy = tokenizer(['message aggregator export'], return_tensors='pt')
+    input_names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in dummy]
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            kwargs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if token_type_ids is not None:
+                kwargs['token_type_ids'] = token_type_ids
+            return self.model(**kwargs)[0]
+
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    tmp_path = f"{onnx_path}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(transformer),
+            tuple(dummy[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+
+    tokenizer.save_pretrained(model_dir)
+    module_names = [type(module).__name__ for module in st_model]
+    with open(os.path.join(model_dir, 'encoder_config.json'), 'w') as f:
+        json.dump({
+            'model_name': model_name,
+            'max_seq_length': st_model.max_seq_length,
+            'dimension': st_model.get_sentence_embedding_dimension(),
+            'normalize': 'Normalize' in module_names
+        }, f)
+
+    os.replace(tmp_path, onnx_path)
+    print(f"✅ ONNX model exported to {onnx_path}")
+
+
+def quantize_onnx_model(onnx_path: str) -> str:
+    """Dynamic int8 quantization of the exported model (weights only, CPU)"""
+    quantized_path = onnx_path.replace('.onnx', '.int8.onnx')
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    with _file_lock(os.path.join(os.path.dirname(onnx_path), 'export.lock')):
+        if os.path.exists(quantized_path):
+            return quantized_path
+        print(f"🔄 Quantizing {onnx_path} to int8...")
+        tmp_path = f"{quantized_path}.tmp"
+        quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+    print(f"✅ Quantized model saved to {quantized_path}")
+    return quantized_path
+
+
+class OnnxSentenceEncoder:
+    """
+    CPU inference for sentence-transformers models through onnxruntime.
+    Exposes the subset of SentenceTransformer used by the curator
+    (encode, get_sentence_embedding_dimension) with mean pooling.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        quantize: bool = False,
+        export_dir: str = DEFAULT_EXPORT_DIR,
+        num_threads: Optional[int] = None
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+
+        onnx_path = export_onnx_model(model_name, export_dir)
+        if quantize:
+            onnx_path = quantize_onnx_model(onnx_path)
+        self.onnx_path = onnx_path
+
+        model_dir = os.path.dirname(onnx_path)
+        with open(os.path.join(model_dir, 'encoder_config.json'), 'r') as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config['dimension']
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """Embed sentences; returns a numpy array like SentenceTransformer.encode"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        dimension = self.get_sentence_embedding_dimension()
+        embeddings = np.zeros((len(sentences), dimension), dtype=np.float32)
+
+        # Length-sorted batches keep padding (and wasted compute) small
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            tokens = self.tokenizer(
+                [sentences[i] for i in batch_idx],
+                padding=True,
+                truncation=True,
+                max_length=self.config['max_seq_length'],
+                return_tensors='np'
+            )
+            feeds = {name: tokens[name].astype(np.int64) for name in self._input_names if name in tokens}
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # Mean pooling over non-padding tokens
+            mask = tokens['attention_mask'][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings[batch_idx] = pooled
+
+        if normalize_embeddings or self.config.get('normalize'):
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+
+        return embeddings[0] if single else embeddings
+
+
+def _rss_mb() -> Optional[float]:
+    """Resident memory of this process in MB (None if it can't be read)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def compare_with_torch(
+    model_name: str,
+    texts: List[str],
+    quantize: bool = False,
+    batch_size: int = 32,
+    repeats: int = 3
+) -> Dict[str, Any]:
+    """
+    Parity, throughput and memory check of the ONNX backend against PyTorch.
+    Parity is the cosine similarity between torch and ONNX embeddings
+    of the same texts (1.0 = identical direction). Memory is the growth in
+    resident set size while loading each backend in this process; ONNX is
+    loaded first, before sentence_transformers/torch are imported (export
+    beforehand so the export's torch import doesn't count).
+    """
+    def loaded(load) -> Tuple[Any, Optional[float]]:
+        before = _rss_mb()
+        model = load()
+        after = _rss_mb()
+        return model, (after - before) if before is not None and after is not None else None
+
+    def load_torch():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device='cpu')
+
+    onnx_model, onnx_rss = loaded(lambda: OnnxSentenceEncoder(model_name, quantize=quantize))
+    torch_model, torch_rss = loaded(load_torch)
+
+    def timed(model) -> Tuple[np.ndarray, float]:
+        model.encode(texts[:batch_size], batch_size=batch_size, normalize_embeddings=True)  # warm-up
+        best = float('inf')
+        result = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+            best = min(best, time.perf_counter() - started)
+        return result, best
+
+    torch_embeddings, torch_seconds = timed(torch_model)
+    onnx_embeddings, onnx_seconds = timed(onnx_model)
+
+    cosines = np.sum(torch_embeddings * onnx_embeddings, axis=1)
+    return {
+        'model_name': model_name,
+        'backend': 'onnx-int8' if quantize else 'onnx',
+        'texts': len(texts),
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+        'max_abs_diff': float(np.abs(torch_embeddings - onnx_embeddings).max()),
+        'torch_texts_per_sec': len(texts) / torch_seconds,
+        'onnx_texts_per_sec': len(texts) / onnx_seconds,
+        'speedup': torch_seconds / onnx_seconds,
+        'torch_rss_mb': torch_rss,
+        'onnx_rss_mb': onnx_rss
+    }
+
+
+if __name__ == "__main__":
+    # python -m app.services.curation.onnx_encoder
+    sample_texts = [
+        f"Message {i}: hiring software engineers for our AI startup, apply before Friday"
+        if i % 3 == 0 else
+        f"Message {i}: lecture notes and exam schedule for the quantum mechanics course"
+        if i % 3 == 1 else
+        f"Message {i}: quarterly revenue update and funding round announcement"
+        for i in range(256)
+    ]
+    export_onnx_model('all-MiniLM-L6-v2')
+    for use_int8 in (False, True):
+        report = compare_with_torch('all-MiniLM-L6-v2', sample_texts, quantize=use_int8)
+        print(f"\n📊 {report['backend']}")
+        print(f"   Parity (cosine): min={report['min_cosine']:.4f} mean={report['mean_cosine']:.4f}")
+        print(f"   Throughput: torch={report['torch_texts_per_sec']:.0f}/s "
+              f"onnx={report['onnx_texts_per_sec']:.0f}/s ({report['speedup']:.2f}x)")
+        if report['onnx_rss_mb'] is not None:
+            print(f"   Resident memory: torch=+{report['torch_rss_mb']:.0f}MB onnx=+{report['onnx_rss_mb']:.0f}MB")
@@ -1,18 +1,133 @@
-from sentence_transformers import SentenceTransformer, util
-import torch
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import os
+import threading
+import time
 import numpy as np
+from .embedding_cache import EmbeddingCache
+from ..message_features import extract_message_text
+
+# torch (default), onnx (fp32 onnxruntime) or onnx-int8 (dynamically quantized)
+SEMANTIC_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+DEFAULT_SEMANTIC_BACKEND = os.getenv('SEMANTIC_BACKEND', 'torch')
 
 class SentenceTransformerCurator:
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(
+        self,
+        model_name: str = 'all-MiniLM-L6-v2',
+        backend: str = DEFAULT_SEMANTIC_BACKEND
+    ):
         """
-        Initialize with a pre-trained sentence transformer model
+        Pre-trained sentence transformer model, loaded lazily
         all-MiniLM-L6-v2: Fast, 80MB, good balance
         all-mpnet-base-v2: Better accuracy, 420MB, slower
+        
+        Nothing heavy happens at import time: the model (and torch) load on
+        first use, or ahead of time via start_background_load().
+        
+        backend: 'torch', or 'onnx' / 'onnx-int8' for onnxruntime CPU inference
+        """
+        if backend not in SEMANTIC_BACKENDS:
+            raise ValueError(f"Unknown semantic backend '{backend}', expected one of {SEMANTIC_BACKENDS}")
+        
+        self.model_name = model_name
+        self.backend = backend
+        self._model = None
+        self._embedding_cache: Optional[EmbeddingCache] = None
+        self._load_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
+        self.load_state = 'not_loaded'  # not_loaded | loading | ready | failed
+        self.load_time: Optional[float] = None
+        self.load_error: Optional[str] = None
+    
+    @property
+    def is_ready(self) -> bool:
+        return self.load_state == 'ready'
+    
+    @property
+    def model(self):
+        """The SentenceTransformer model (blocks until loaded)"""
+        self.load()
+        return self._model
+    
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        self.load()
+        return self._embedding_cache
+    
+    def load(self):
+        """Load the model once; concurrent callers wait for the same load"""
+        if self._model is not None:
+            return
+        
+        with self._load_lock:
+            if self._model is not None:
+                return
+            
+            self.load_state = 'loading'
+            print(f"🔄 Loading Sentence Transformer model: {self.model_name} ({self.backend})")
+            started = time.perf_counter()
+            try:
+                if self.backend == 'torch':
+                    from sentence_transformers import SentenceTransformer
+                    
+                    model = SentenceTransformer(self.model_name)
+                    cache_namespace = self.model_name
+                else:
+                    from .onnx_encoder import OnnxSentenceEncoder
+                    
+                    model = OnnxSentenceEncoder(
+                        self.model_name,
+                        quantize=(self.backend == 'onnx-int8')
+                    )
+                    # Quantized vectors differ slightly: keep them in their own cache space
+                    cache_namespace = f"{self.model_name}:{self.backend}"
+                
+                self._embedding_cache = EmbeddingCache(
+                    cache_namespace,
+                    model.get_sentence_embedding_dimension()
+                )
+                self._model = model
+                self.load_time = time.perf_counter() - started
+                self.load_state = 'ready'
+                self.load_error = None
+                print(f"✅ Model loaded successfully in {self.load_time:.1f}s")
+            except Exception as e:
+                self.load_state = 'failed'
+                self.load_error = str(e)
+                print(f"❌ Error loading Sentence Transformer model: {e}")
+                raise
+    
+    def start_background_load(self, retry: bool = False):
+        """
+        Warm the model in a daemon thread without blocking startup.
+        A failed load is not retried automatically (every curation request
+        would reload the model); pass retry=True to try again on purpose.
         """
-        print(f"🔄 Loading Sentence Transformer model: {model_name}")
-        self.model = SentenceTransformer(model_name)
-        print(f"✅ Model loaded successfully")
+        if self._model is not None or (self._load_thread and self._load_thread.is_alive()):
+            return
+        if self.load_state == 'failed' and not retry:
+            return
+        
+        def _load():
+            try:
+                self.load()
+            except Exception:
+                pass  # Recorded in load_state / load_error
+        
+        self.load_state = 'loading'
+        self._load_thread = threading.Thread(target=_load, name='sentence-model-loader', daemon=True)
+        self._load_thread.start()
+    
+    def status(self) -> Dict[str, Any]:
+        """Model load state for the readiness endpoint"""
+        return {
+            'model_name': self.model_name,
+            'backend': self.backend,
+            'state': self.load_state,
+            'ready': self.is_ready,
+            'load_time_seconds': self.load_time,
+            'error': self.load_error
+        }
     
     def calculate_semantic_similarity(
         self,
@@ -31,14 +146,16 @@ class SentenceTransformerCurator:
         # Combine preferences into one text
         preferences_text = ' '.join(preferences)
         
-        # Encode both texts
-        message_embedding = self.model.encode(message_text, convert_to_tensor=True)
-        preference_embedding = self.model.encode(preferences_text, convert_to_tensor=True)
-        
-        # Calculate cosine similarity
-        similarity = util.cos_sim(message_embedding, preference_embedding)
+        # Encode both texts (message vector comes from the cache when seen before)
+        message_embedding = self.encode_texts([message_text])[0]
+        preference_embedding = self.model.encode(
+            preferences_text,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
         
-        return float(similarity.item())
+        # Cosine similarity of normalized vectors
+        return float(np.dot(message_embedding, preference_embedding))
     
     def calculate_multi_preference_similarity(
         self,
@@ -50,27 +167,118 @@ class SentenceTransformerCurator:
         if not message_text or not preferences:
             return {}
         
-        # Encode message once
-        message_embedding = self.model.encode(message_text, convert_to_tensor=True)
+        # Encode message once, all preferences in one batch
+        message_embedding = self.encode_texts([message_text])[0]
+        pref_embeddings = self.model.encode(
+            list(preferences),
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
         
         # Calculate similarity with each preference
-        similarities = {}
-        for pref in preferences:
-            pref_embedding = self.model.encode(pref, convert_to_tensor=True)
-            similarity = util.cos_sim(message_embedding, pref_embedding)
-            similarities[pref] = float(similarity.item())
+        similarities = pref_embeddings @ message_embedding
+        return {pref: float(sim) for pref, sim in zip(preferences, similarities)}
+    
+    def encode_texts(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Normalized embeddings for texts, served from the embedding cache
+        where possible. Only cache misses are sent to the model, in one batch.
+        """
+        embeddings = np.zeros((len(texts), self.embedding_cache.dimension), dtype=np.float32)
+        cached = self.embedding_cache.get_many(texts)
+        
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                embeddings[i] = vector
+        
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            encoded = self.model.encode(
+                missing_texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            embeddings[missing] = encoded
+            self.embedding_cache.put_many(missing_texts, encoded)
+        
+        return embeddings
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Embedding cache hit/miss counters"""
+        if self._embedding_cache is None:
+            return {}
+        return self._embedding_cache.stats()
+    
+    def encode_preferences(self, preferences: List[str], per_preference: bool = False) -> np.ndarray:
+        """
+        Encode preferences once per request.
+        Row 0 is the joined preference text (same target as
+        calculate_semantic_similarity); with per_preference, rows 1..n are
+        the individual preferences.
+        """
+        preference_texts = [' '.join(preferences)]
+        if per_preference:
+            preference_texts += list(preferences)
+        return self.model.encode(
+            preference_texts,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    
+    def calculate_batch_similarity(
+        self,
+        messages: List[Dict[str, Any]],
+        preferences: List[str],
+        batch_size: int = 64
+    ) -> np.ndarray:
+        """
+        Score all messages against all preferences in one pass.
+        
+        Returns a (len(messages), 1 + len(preferences)) cosine similarity matrix.
+        Column 0 matches calculate_semantic_similarity, the remaining columns
+        match calculate_multi_preference_similarity in preference order.
+        """
+        texts = [self._extract_message_text(msg) for msg in messages]
+        return self.calculate_text_similarity(texts, preferences, batch_size, per_preference=True)
+    
+    def calculate_text_similarity(
+        self,
+        texts: List[str],
+        preferences: List[str],
+        batch_size: int = 64,
+        per_preference: bool = False
+    ) -> np.ndarray:
+        """
+        Similarity of already-extracted message texts to the joined
+        preferences (one column), plus one column per preference when
+        per_preference is set (the calculate_batch_similarity layout)
+        """
+        columns = len(preferences) + 1 if per_preference else 1
+        scores = np.zeros((len(texts), columns), dtype=np.float32)
+        if not preferences or not texts:
+            return scores
+        
+        # Messages without text keep a score of 0.0, like the per-message path
+        indices = [i for i, text in enumerate(texts) if text]
+        if not indices:
+            return scores
+        
+        # One batched encode for every message not already cached
+        message_embeddings = self.encode_texts(
+            [texts[i] for i in indices],
+            batch_size=batch_size
+        )
+        preference_embeddings = self.encode_preferences(preferences, per_preference)
         
-        return similarities
+        # Normalized vectors: one matrix product gives every cosine similarity
+        scores[indices] = message_embeddings @ preference_embeddings.T
+        return scores
     
     def _extract_message_text(self, message: Dict[str, Any]) -> str:
         """Extract all relevant text from message"""
-        text_parts = [
-            message.get('title', ''),
-            message.get('content', ''),
-            message.get('sender', ''),
-            message.get('chat', ''),
-        ]
-        return ' '.join([str(part) for part in text_parts if part])
+        return extract_message_text(message)
 
 # Singleton instance
 sentence_curator = SentenceTransformerCurator()
\ No newline at end of file
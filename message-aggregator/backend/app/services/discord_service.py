@@ -1,10 +1,13 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+import heapq
 import os
 import discord
 from discord.ext import commands
 import asyncio
 from dotenv import load_dotenv, find_dotenv
 from datetime import datetime
+from app.services.push_hub import push_hub
 
 # Load .env from project root and override
 load_dotenv(find_dotenv(), override=True)
@@ -14,20 +17,54 @@ if not os.getenv('DISCORD_BOT_TOKEN'):
     load_dotenv(env_path, override=True)
 
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
-DISCORD_CHANNEL_ID = os.getenv('DISCORD_CHANNEL_ID')
+
+# Ring buffer size per channel, and history fetched per channel on (re)connect
+DISCORD_BUFFER_PER_CHANNEL = int(os.getenv('DISCORD_BUFFER_PER_CHANNEL', '100'))
+DISCORD_BACKFILL_LIMIT = int(os.getenv('DISCORD_BACKFILL_LIMIT', '50'))
+DISCORD_BACKFILL_CONCURRENCY = int(os.getenv('DISCORD_BACKFILL_CONCURRENCY', '4'))
 
 class DiscordService:
+    """
+    Discord bot whose gateway events (on_message / on_message_edit /
+    on_message_delete) keep a bounded buffer per channel for every guild
+    text channel it can read. REST history is only used to backfill after
+    a fresh gateway session (startup or a reconnect that couldn't resume),
+    so feed reads make no REST calls.
+    """
+    
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
         intents.guilds = True
         self.client = discord.Client(intents=intents)
         self.is_ready = False
+        # channel id -> {message id: message dict}, oldest first
+        self._buffers: Dict[int, "OrderedDict[int, Dict[str, Any]]"] = {}
+        self._backfill_task: Optional[asyncio.Task] = None
         
         @self.client.event
         async def on_ready():
             self.is_ready = True
             print(f'✅ Discord bot logged in as {self.client.user}')
+            # New session: events while disconnected were not replayed
+            self._backfill_task = asyncio.create_task(self._backfill())
+        
+        @self.client.event
+        async def on_message(message):
+            if self._is_buffered_channel(message.channel):
+                push_hub.publish_messages([self._buffer_message(message)])
+        
+        @self.client.event
+        async def on_message_edit(before, after):
+            # Only refresh buffered messages in place; an edit to an older
+            # message must not become the newest entry
+            buffer = self._buffers.get(after.channel.id)
+            if buffer is not None and after.id in buffer:
+                buffer[after.id] = self._normalize(after)
+        
+        @self.client.event
+        async def on_message_delete(message):
+            self._buffers.get(message.channel.id, {}).pop(message.id, None)
     
     async def start_bot(self):
         """Start the Discord bot in the background"""
@@ -50,8 +87,94 @@ class DiscordService:
         except Exception as e:
             print(f"❌ Error starting Discord bot: {e}")
     
+    @staticmethod
+    def _is_buffered_channel(channel) -> bool:
+        return isinstance(channel, (discord.TextChannel, discord.Thread))
+    
+    def _readable_channels(self) -> List[discord.TextChannel]:
+        channels = []
+        for guild in self.client.guilds:
+            for channel in guild.text_channels:
+                permissions = channel.permissions_for(guild.me)
+                if permissions.read_messages and permissions.read_message_history:
+                    channels.append(channel)
+        return channels
+    
+    async def _backfill(self):
+        """Fetch recent history per channel, after the newest buffered message"""
+        semaphore = asyncio.Semaphore(DISCORD_BACKFILL_CONCURRENCY)
+        
+        async def backfill_channel(channel):
+            buffer = self._buffers.get(channel.id)
+            # Newest N (with `after`, history() would default to the oldest N after the mark)
+            history_args = {'limit': DISCORD_BACKFILL_LIMIT, 'oldest_first': False}
+            if buffer:
+                history_args['after'] = discord.Object(id=next(reversed(buffer)))
+            async with semaphore:
+                history = [message async for message in channel.history(**history_args)]
+            if buffer and len(history) >= DISCORD_BACKFILL_LIMIT:
+                # More was missed than we fetched: drop the stale side of the hole
+                buffer.clear()
+            # Oldest first so the buffer stays in order
+            for message in sorted(history, key=lambda m: m.id):
+                self._buffer_message(message)
+            return len(history)
+        
+        channels = self._readable_channels()
+        results = await asyncio.gather(*(backfill_channel(ch) for ch in channels), return_exceptions=True)
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                print(f"⚠️  Discord backfill failed for #{channel.name}: {result}")
+        fetched = sum(r for r in results if isinstance(r, int))
+        print(f"✅ Discord backfill: {fetched} messages from {len(channels)} channels")
+    
+    def _buffer_message(self, msg):
+        buffer = self._buffers.setdefault(msg.channel.id, OrderedDict())
+        normalized = self._normalize(msg)
+        buffer[msg.id] = normalized
+        while len(buffer) > DISCORD_BUFFER_PER_CHANNEL:
+            buffer.popitem(last=False)
+        return normalized
+    
+    @staticmethod
+    def _normalize(msg) -> Dict[str, Any]:
+        """discord.Message -> aggregator message dict"""
+        # Extract text content
+        content_parts = []
+        
+        # Plain text
+        if msg.content:
+            content_parts.append(msg.content)
+        
+        # Embeds
+        for embed in msg.embeds:
+            if embed.description:
+                content_parts.append(f"[Embed] {embed.description}")
+            if embed.title:
+                content_parts.append(f"[Title] {embed.title}")
+        
+        # Attachments
+        attachment_urls = [att.url for att in msg.attachments]
+        if attachment_urls:
+            content_parts.append(f"[Attachments: {', '.join(attachment_urls)}]")
+        
+        full_content = "\n".join(content_parts) if content_parts else "No content"
+        
+        return {
+            'id': f"discord_{msg.id}",
+            'platform': 'discord',
+            'title': f"Message from {msg.author.name}",
+            'content': full_content,
+            'sender': msg.author.name,
+            'timestamp': msg.created_at.isoformat(),
+            'chat': msg.channel.name,
+            'channel_id': str(msg.channel.id),
+            'url': msg.jump_url,
+            'attachments': attachment_urls
+        }
+    
     async def fetch_messages(self, limit: int = 20, channel_id: str = None) -> List[Dict[str, Any]]:
-        """Fetch recent messages from Discord channel"""
+        """Newest buffered messages across channels (or from one channel)"""
         if not self.is_ready:
             print("⚠️  Discord bot not ready, attempting to start...")
             await self.start_bot()
@@ -60,61 +183,23 @@ class DiscordService:
             print("❌ Discord bot not connected")
             return []
         
-        messages = []
-        target_channel_id = channel_id or DISCORD_CHANNEL_ID
+        if self._backfill_task is not None and not self._backfill_task.done():
+            # First read after connecting: wait for history instead of returning an empty feed
+            await asyncio.shield(self._backfill_task)
         
-        try:
-            channel = await self.client.fetch_channel(int(target_channel_id))
-            
-            if not channel:
-                print(f"❌ Channel {target_channel_id} not found")
-                return []
-            
-            discord_messages = []
-            async for message in channel.history(limit=limit):
-                discord_messages.append(message)
-            
-            for msg in discord_messages:
-                # Extract text content
-                content_parts = []
-                
-                # Plain text
-                if msg.content:
-                    content_parts.append(msg.content)
-                
-                # Embeds
-                for embed in msg.embeds:
-                    if embed.description:
-                        content_parts.append(f"[Embed] {embed.description}")
-                    if embed.title:
-                        content_parts.append(f"[Title] {embed.title}")
-                
-                # Attachments
-                attachment_urls = [att.url for att in msg.attachments]
-                if attachment_urls:
-                    content_parts.append(f"[Attachments: {', '.join(attachment_urls)}]")
-                
-                full_content = "\n".join(content_parts) if content_parts else "No content"
-                
-                messages.append({
-                    'id': f"discord_{msg.id}",
-                    'platform': 'discord',
-                    'title': f"Message from {msg.author.name}",
-                    'content': full_content,
-                    'sender': msg.author.name,
-                    'timestamp': msg.created_at.isoformat(),
-                    'chat': channel.name,
-                    'url': msg.jump_url,
-                    'attachments': attachment_urls
-                })
-            
-            print(f"✅ Fetched {len(messages)} Discord messages from #{channel.name}")
-            
-        except Exception as e:
-            print(f"❌ Error fetching Discord messages: {e}")
-            import traceback
-            traceback.print_exc()
+        if channel_id:
+            buffers = [self._buffers.get(int(channel_id), {})]
+        else:
+            buffers = list(self._buffers.values())
         
+        # Snowflakes are time-ordered: newest first across channels
+        newest = heapq.nlargest(
+            limit,
+            (item for buffer in buffers for item in buffer.items()),
+            key=lambda item: item[0]
+        )
+        messages = [msg for _, msg in newest]
+        print(f"✅ Read {len(messages)} Discord messages from {len(buffers)} channel buffers")
         return messages
     
     async def close(self):
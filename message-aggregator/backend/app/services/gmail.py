@@ -1,12 +1,17 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import os
 import base64
+import html
 import re
+import threading
+from collections import OrderedDict
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+from app.services.sync_state import sync_state
+from app.services.html_text import html_to_text
 
 load_dotenv()
 
@@ -15,6 +20,21 @@ CLIENT_ID = os.getenv('GOOGLE_OAUTH_CLIENT_ID')
 CLIENT_SECRET = os.getenv('GOOGLE_OAUTH_CLIENT_SECRET')
 REDIRECT_URI = "http://localhost:8000/auth/gmail/callback"
 
+# Gmail allows up to 100 calls per batch request but recommends at most 50
+GMAIL_BATCH_SIZE = 50
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
+# Upper bound on cleaned body length (embedding and JSON output never need more)
+GMAIL_MAX_BODY_CHARS = int(os.getenv('GMAIL_MAX_BODY_CHARS', '20000'))
+GMAIL_BODY_CACHE_ENTRIES = int(os.getenv('GMAIL_BODY_CACHE_ENTRIES', '2000'))
+
+_HTML_MARKER_RE = re.compile(r'<(?:html|body|div|p|table)\b', re.IGNORECASE)
+
+# Cleaned bodies by (user id, Gmail message id): message contents never change,
+# and keying on the owner means a body is only served to the mailbox it came from
+_body_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_body_cache_lock = threading.Lock()
+
 # Required for local development
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
@@ -31,8 +51,12 @@ class GmailService:
             except Exception as e:
                 print(f"❌ Error building Gmail service: {e}")
     
-    def fetch_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
-        """Fetch recent Gmail messages"""
+    def fetch_messages(self, limit: int = 20, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch recent Gmail messages.
+        With a user_id, later calls only fetch messages added since the
+        stored historyId and merge them with the ones already fetched.
+        """
         if not self.service:
             print("⚠️  Gmail service not initialized - OAuth required")
             return []
@@ -40,42 +64,38 @@ class GmailService:
         messages = []
         
         try:
-            results = self.service.users().messages().list(
-                userId='me',
-                maxResults=limit,
-                labelIds=['INBOX']
-            ).execute()
+            cursor = sync_state.get_cursor(user_id, 'gmail') if user_id else None
+            message_ids, history_id = None, None
             
-            message_list = results.get('messages', [])
+            if cursor:
+                message_ids, history_id = self._list_new_message_ids(cursor)
             
-            for msg_data in message_list:
-                msg = self.service.users().messages().get(
+            if message_ids is None:
+                # Full fetch: take the mailbox historyId first so nothing added
+                # during the listing is skipped next time
+                history_id = self.service.users().getProfile(userId='me').execute().get('historyId')
+                results = self.service.users().messages().list(
                     userId='me',
-                    id=msg_data['id'],
-                    format='full'
+                    maxResults=limit,
+                    labelIds=['INBOX']
                 ).execute()
-                
-                headers = msg['payload'].get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-                date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-                
-                # Get message body
-                body = self._get_message_body(msg['payload'])
-                
-                # Clean HTML content
-                clean_body = self._clean_html_content(body)
-                
-                messages.append({
-                    'id': f"gmail_{msg['id']}",
-                    'platform': 'gmail',
-                    'title': subject,
-                    'content': clean_body,
-                    'sender': sender,
-                    'timestamp': date,
-                    'chat': 'Gmail',
-                    'url': f"https://mail.google.com/mail/u/0/#inbox/{msg['id']}"
-                })
+                message_ids = [m['id'] for m in results.get('messages', [])]
+            else:
+                print(f"🔄 Gmail incremental sync: {len(message_ids)} new messages")
+            
+            # Headers + snippet only; bodies are loaded on demand (load_bodies)
+            resources = self._batch_get(
+                message_ids[:limit],
+                format='metadata',
+                metadataHeaders=METADATA_HEADERS
+            )
+            messages = [
+                self._build_message(resources[message_id])
+                for message_id in message_ids[:limit] if message_id in resources
+            ]
+            
+            if user_id:
+                messages = sync_state.merge(user_id, 'gmail', messages, history_id, limit)
             
             print(f"✅ Fetched {len(messages)} Gmail messages")
             
@@ -86,6 +106,165 @@ class GmailService:
         
         return messages
     
+    def _list_new_message_ids(self, start_history_id: str) -> Tuple[Optional[List[str]], Optional[str]]:
+        """
+        Message ids added to the inbox since start_history_id (newest first)
+        and the new historyId. Returns (None, None) when the history is too
+        old and a full fetch is needed.
+        """
+        message_ids = []
+        page_token = None
+        try:
+            while True:
+                response = self.service.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'],
+                    labelId='INBOX',
+                    pageToken=page_token
+                ).execute()
+                
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message_ids.append(added['message']['id'])
+                
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as e:
+            if e.resp.status == 404:
+                print("⚠️  Gmail history expired, falling back to full sync")
+                return None, None
+            raise
+        
+        # History is oldest first
+        unique_ids = list(dict.fromkeys(reversed(message_ids)))
+        return unique_ids, response.get('historyId', start_history_id)
+    
+    def _batch_get(self, message_ids: List[str], **params) -> Dict[str, Dict[str, Any]]:
+        """
+        messages().get for many ids using batch HTTP requests
+        (one round trip per GMAIL_BATCH_SIZE ids). Returns {id: resource};
+        ids that failed are retried once in a follow-up batch.
+        """
+        resources = {}
+        pending = list(message_ids)
+        
+        for attempt in range(2):
+            failed = []
+            
+            def on_response(request_id, response, exception):
+                if exception is not None:
+                    failed.append(request_id)
+                    if attempt:
+                        print(f"⚠️  Gmail batch get failed for {request_id}: {exception}")
+                else:
+                    resources[request_id] = response
+            
+            for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=on_response)
+                for message_id in pending[start:start + GMAIL_BATCH_SIZE]:
+                    batch.add(
+                        self.service.users().messages().get(userId='me', id=message_id, **params),
+                        request_id=message_id
+                    )
+                batch.execute()
+            
+            if not failed:
+                break
+            pending = failed
+        
+        return resources
+    
+    def _build_message(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Normalize a Gmail API message resource (metadata format).
+        Content is the snippet until the body is loaded.
+        """
+        headers = msg['payload'].get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
+        sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
+        date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
+        
+        # Snippets come HTML-escaped (&#39; etc.)
+        snippet = html.unescape(msg.get('snippet', '')).strip()
+        
+        return {
+            'id': f"gmail_{msg['id']}",
+            'gmail_id': msg['id'],
+            'platform': 'gmail',
+            'title': subject,
+            'content': snippet or "No content",
+            'body_loaded': False,
+            'sender': sender,
+            'timestamp': date,
+            'chat': 'Gmail',
+            'url': f"https://mail.google.com/mail/u/0/#inbox/{msg['id']}"
+        }
+    
+    def fetch_bodies(self, gmail_ids: List[str], user_id: Optional[str]) -> Dict[str, str]:
+        """
+        Full, cleaned bodies for Gmail message ids of user_id's mailbox,
+        fetched in batches (without a user id nothing is cached)
+        """
+        if not self.service or not gmail_ids:
+            return {}
+        
+        bodies = {}
+        missing = []
+        with _body_cache_lock:
+            for message_id in dict.fromkeys(gmail_ids):
+                key = (user_id, message_id)
+                if user_id and key in _body_cache:
+                    _body_cache.move_to_end(key)
+                    bodies[message_id] = _body_cache[key]
+                else:
+                    missing.append(message_id)
+        
+        if missing:
+            resources = self._batch_get(missing, format='full')
+            cleaned = {
+                message_id: self._clean_html_content(self._get_message_body(msg['payload']))
+                for message_id, msg in resources.items()
+            }
+            bodies.update(cleaned)
+            if user_id:
+                with _body_cache_lock:
+                    _body_cache.update(((user_id, message_id), body) for message_id, body in cleaned.items())
+                    while len(_body_cache) > GMAIL_BODY_CACHE_ENTRIES:
+                        _body_cache.popitem(last=False)
+        
+        return bodies
+    
+    def load_bodies(self, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Replace snippets with full bodies (in place) for Gmail messages that
+        don't have them yet. Returns the messages that were updated.
+        """
+        pending = [
+            msg for msg in messages
+            if msg.get('platform') == 'gmail' and msg.get('body_loaded') is False
+        ]
+        if not pending:
+            return []
+        
+        try:
+            bodies = self.fetch_bodies([msg['gmail_id'] for msg in pending], user_id)
+        except Exception as e:
+            print(f"❌ Error loading Gmail bodies: {e}")
+            return []
+        
+        updated = []
+        for msg in pending:
+            body = bodies.get(msg['gmail_id'])
+            if body is not None:
+                msg['content'] = body
+                msg['body_loaded'] = True
+                updated.append(msg)
+        
+        print(f"✅ Loaded {len(updated)} Gmail message bodies")
+        return updated
+    
     def _get_message_body(self, payload):
         """Extract message body from Gmail payload"""
         body = ""
@@ -122,37 +301,23 @@ class GmailService:
         return ""
     
     def _clean_html_content(self, html_content: str) -> str:
-        """Convert HTML to clean plain text"""
+        """Convert HTML to clean plain text (at most GMAIL_MAX_BODY_CHARS)"""
         if not html_content or html_content == "No content":
             return "No content"
         
         # Check if content is HTML
-        if not ('<html' in html_content.lower() or '<div' in html_content.lower() or '<p' in html_content.lower()):
+        if not _HTML_MARKER_RE.search(html_content):
             # Already plain text, just clean up
             return self._clean_plain_text(html_content)
         
-        try:
-            # Parse HTML with BeautifulSoup
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style", "head", "title", "meta", "[document]"]):
-                script.decompose()
-            
-            # Get text
-            text = soup.get_text()
-            
-            # Clean up text
-            return self._clean_plain_text(text)
-            
-        except Exception as e:
-            print(f"⚠️  Error parsing HTML: {e}")
-            # Fallback: strip HTML tags with regex
-            text = re.sub('<[^<]+?>', '', html_content)
-            return self._clean_plain_text(text)
+        # lxml streams the document and stops once enough text is collected
+        return self._clean_plain_text(html_to_text(html_content, GMAIL_MAX_BODY_CHARS))
     
     def _clean_plain_text(self, text: str) -> str:
         """Clean up plain text content"""
+        # Cap before the line/regex passes so their cost is bounded too
+        text = text[:GMAIL_MAX_BODY_CHARS]
+        
         # Break into lines and remove leading/trailing whitespace
         lines = (line.strip() for line in text.splitlines())
         
@@ -168,7 +333,6 @@ class GmailService:
         # Remove excessive blank lines (more than 2 consecutive)
         text = re.sub(r'\n{3,}', '\n\n', text)
         
-        # Return full text - NO TRUNCATION
         return text.strip() if text.strip() else "No content"
 
 def get_oauth_flow():
@@ -191,54 +355,74 @@ def get_oauth_flow():
     )
     return flow
 
-def fetch_gmail_messages(limit: int = 20, credentials_dict: dict = None) -> List[Dict[str, Any]]:
+def build_credentials(credentials_dict: dict = None) -> Optional[Credentials]:
+    """Reconstruct OAuth credentials stored in Firestore (None if unusable)"""
+    if not credentials_dict:
+        print("⚠️  Gmail requires OAuth authentication - not yet configured")
+        return None
+    
+    # ✅ FIX: Check if fields exist AND are not empty/None
+    required_fields = ['token', 'token_uri', 'client_id', 'client_secret']
+    missing_fields = []
+    
+    for field in required_fields:
+        value = credentials_dict.get(field)
+        if not value or value == 'None' or value == '':
+            missing_fields.append(field)
+    
+    # refresh_token might be None if token is still valid
+    refresh_token = credentials_dict.get('refresh_token')
+    
+    if missing_fields:
+        print(f"❌ Missing or empty credential fields: {missing_fields}")
+        # Field names only: values are tokens and secrets
+        print(f"   Available fields: {list(credentials_dict.keys())}")
+        return None
+    
+    # Reconstruct credentials from dict
+    credentials = Credentials(
+        token=credentials_dict.get('token'),
+        refresh_token=refresh_token,  # Can be None
+        token_uri=credentials_dict.get('token_uri'),
+        client_id=credentials_dict.get('client_id'),
+        client_secret=credentials_dict.get('client_secret'),
+        scopes=credentials_dict.get('scopes')
+    )
+    
+    print("✅ Gmail credentials reconstructed successfully")
+    return credentials
+
+def fetch_gmail_messages(
+    limit: int = 20,
+    credentials_dict: dict = None,
+    user_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
     """Standalone function - uses provided credentials"""
     try:
-        if not credentials_dict:
-            print("⚠️  Gmail requires OAuth authentication - not yet configured")
+        credentials = build_credentials(credentials_dict)
+        if not credentials:
             return []
         
-        print(f"🔍 Credentials dict: {credentials_dict}")
-        
-        # ✅ FIX: Check if fields exist AND are not empty/None
-        required_fields = ['token', 'token_uri', 'client_id', 'client_secret']
-        missing_fields = []
-        
-        for field in required_fields:
-            value = credentials_dict.get(field)
-            if not value or value == 'None' or value == '':
-                missing_fields.append(field)
-        
-        # refresh_token might be None if token is still valid
-        refresh_token = credentials_dict.get('refresh_token')
-        
-        if missing_fields:
-            print(f"❌ Missing or empty credential fields: {missing_fields}")
-            print(f"   Available fields: {list(credentials_dict.keys())}")
-            for field in credentials_dict:
-                value = credentials_dict[field]
-                if isinstance(value, str):
-                    print(f"   {field}: {value[:20]}..." if len(str(value)) > 20 else f"   {field}: {value}")
-                else:
-                    print(f"   {field}: {value}")
-            return []
-        
-        # Reconstruct credentials from dict
-        credentials = Credentials(
-            token=credentials_dict.get('token'),
-            refresh_token=refresh_token,  # Can be None
-            token_uri=credentials_dict.get('token_uri'),
-            client_id=credentials_dict.get('client_id'),
-            client_secret=credentials_dict.get('client_secret'),
-            scopes=credentials_dict.get('scopes')
-        )
-        
-        print("✅ Gmail credentials reconstructed successfully")
-        
         service = GmailService(credentials)
-        return service.fetch_messages(limit)
+        return service.fetch_messages(limit, user_id)
     except Exception as e:
         print(f"❌ Gmail fetch error: {e}")
         import traceback
         traceback.print_exc()
-        return []
\ No newline at end of file
+        return []
+
+def load_gmail_bodies(
+    messages: List[Dict[str, Any]],
+    credentials_dict: dict = None,
+    user_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Standalone function - load full bodies for Gmail messages in place"""
+    try:
+        credentials = build_credentials(credentials_dict)
+        if not credentials:
+            return []
+        
+        return GmailService(credentials).load_bodies(messages, user_id)
+    except Exception as e:
+        print(f"❌ Gmail body fetch error: {e}")
+        return []
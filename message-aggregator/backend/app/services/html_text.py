@@ -0,0 +1,79 @@
+from typing import List
+import re
+from lxml import etree
+
+# Elements whose text is never shown
+SKIP_TAGS = {'script', 'style', 'head', 'title', 'meta', 'noscript', 'template'}
+# Elements that start a new line in rendered text
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'section', 'article',
+    'header', 'footer', 'blockquote', 'pre', 'hr',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6'
+}
+
+FEED_CHUNK = 64 * 1024
+
+_TAG_RE = re.compile(r'<[^<]+?>')
+
+
+class _TextCollector:
+    """lxml parser target: collects visible text as the document streams in"""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.skip_depth = 0
+
+    @property
+    def full(self) -> bool:
+        return self.length >= self.max_chars
+
+    def start(self, tag, attrib):
+        tag = tag.lower()
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._append('\n')
+
+    def end(self, tag):
+        tag = tag.lower()
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._append('\n')
+
+    def data(self, data):
+        if not self.skip_depth:
+            self._append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return ''.join(self.parts)[:self.max_chars]
+
+    def _append(self, text: str):
+        if not self.full:
+            self.parts.append(text)
+            self.length += len(text)
+
+
+def html_to_text(html_content: str, max_chars: int) -> str:
+    """
+    Visible text of an HTML document using lxml's C parser.
+    Input is fed in chunks and parsing stops once max_chars of text
+    have been collected, so huge newsletters cost no more than small ones.
+    """
+    collector = _TextCollector(max_chars)
+    parser = etree.HTMLParser(target=collector, remove_comments=True, recover=True)
+    try:
+        for start in range(0, len(html_content), FEED_CHUNK):
+            parser.feed(html_content[start:start + FEED_CHUNK])
+            if collector.full:
+                break
+        return parser.close()
+    except etree.LxmlError as e:
+        print(f"⚠️  Error parsing HTML: {e}")
+        # Fallback: strip HTML tags with regex
+        return _TAG_RE.sub('', html_content[:max_chars * 4])[:max_chars]
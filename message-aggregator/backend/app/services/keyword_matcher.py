@@ -0,0 +1,73 @@
+from typing import List, Dict, Iterable, Tuple
+from collections import deque
+from functools import lru_cache
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of terms.
+    Finds every (possibly overlapping) substring occurrence of every term
+    in a single linear pass over the text, independent of the number of terms.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        # Empty terms can't be matched by the automaton; callers treat them separately
+        self.terms: List[str] = sorted({term for term in terms if term})
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for index, term in enumerate(self.terms):
+            self._add_term(term, index)
+        self._build_failure_links()
+
+    def _add_term(self, term: str, index: int):
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(index)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                # Inherit matches of the longest proper suffix
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def count(self, text: str) -> Dict[str, int]:
+        """Per-term hit counts for text (terms with no hits are omitted)"""
+        hits: Dict[str, int] = {}
+        if not self.terms or not text:
+            return hits
+
+        goto, fail, output, terms = self._goto, self._fail, self._output, self.terms
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                term = terms[index]
+                hits[term] = hits.get(term, 0) + 1
+        return hits
+
+
+@lru_cache(maxsize=256)
+def get_keyword_matcher(terms: Tuple[str, ...]) -> KeywordMatcher:
+    """Compiled matcher for a term set, built once and reused across requests"""
+    return KeywordMatcher(terms)
@@ -0,0 +1,45 @@
+from typing import Dict, Any, Optional
+
+
+def extract_message_text(message: Dict[str, Any]) -> str:
+    """Join the text fields of a message (title, content, sender, chat)"""
+    text_parts = [
+        message.get('title', ''),
+        message.get('content', ''),
+        message.get('sender', ''),
+        message.get('chat', ''),
+    ]
+    return ' '.join([str(part) for part in text_parts if part])
+
+
+class MessageFeatures:
+    """
+    Per-message features computed once per request.
+    MessageFilter fills the lexical features, HybridContentCurator fills the
+    semantic score; both read the same record instead of rescoring.
+    """
+
+    __slots__ = (
+        'message',
+        'raw_text',
+        'text',
+        'term_hits',
+        'keyword_score',
+        'tfidf_similarity',
+        'importance_score',
+        'semantic_score',
+    )
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self.raw_text = extract_message_text(message)
+        self.text = self.raw_text.lower()
+        self.term_hits: Dict[str, int] = {}
+        self.keyword_score = 0.0
+        self.tfidf_similarity = 0.0
+        self.importance_score = 0.0
+        self.semantic_score: Optional[float] = None
+
+    def has_term(self, term: str) -> bool:
+        """True if term occurs in the message text (empty terms always match)"""
+        return not term or term in self.term_hits
@@ -1,13 +1,16 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import re
+from app.services.keyword_matcher import get_keyword_matcher
+from app.services.message_features import MessageFeatures, extract_message_text
 
 class MessageFilter:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            max_features=500,
+    @staticmethod
+    def _make_vectorizer(max_features: Optional[int] = None) -> TfidfVectorizer:
+        """Fresh vectorizer per scoring call so concurrent requests never share fitted state"""
+        return TfidfVectorizer(
+            max_features=max_features,
             stop_words='english',
             ngram_range=(1, 2),
             lowercase=True
@@ -15,41 +18,61 @@ class MessageFilter:
         
     def _extract_text_from_message(self, message: Dict[str, Any]) -> str:
         """Extract all text from message for analysis"""
-        text_parts = [
-            message.get('title', ''),
-            message.get('content', ''),
-            message.get('sender', ''),
-            message.get('chat', ''),
-        ]
-        return ' '.join([str(part) for part in text_parts if part]).lower()
+        return extract_message_text(message).lower()
     
-    def _keyword_match_score(self, message_text: str, preferences: List[str]) -> float:
+    # Keyword mappings for better matching
+    KEYWORD_EXPANSIONS = {
+        'job opportunities': ['job', 'hiring', 'career', 'employment', 'position', 'vacancy', 'work', 'internship', 'recruit'],
+        'study materials': ['study', 'course', 'tutorial', 'learning', 'education', 'lecture', 'pdf', 'notes', 'exam', 'test'],
+        'physics': ['physics', 'quantum', 'mechanics', 'thermodynamics', 'relativity', 'particle', 'motion', 'energy'],
+        'technology': ['tech', 'software', 'hardware', 'ai', 'programming', 'code', 'computer', 'app', 'digital', 'cyber', 'data', 'algorithm'],
+        'business': ['business', 'startup', 'entrepreneur', 'funding', 'investment', 'market', 'sales', 'revenue'],
+        'donald trump': ['trump', 'donald trump', 'president trump']
+    }
+    
+    @classmethod
+    def _preference_terms(cls, preferences: List[str]) -> Tuple[str, ...]:
+        """Every phrase, expansion and fallback word the keyword score looks for"""
+        terms = set()
+        for pref in preferences:
+            pref_lower = pref.lower()
+            terms.add(pref_lower)
+            terms.update(cls.KEYWORD_EXPANSIONS.get(pref_lower, []))
+            terms.update(w for w in pref_lower.split() if len(w) > 3)
+        return tuple(sorted(terms))
+    
+    def match_preference_terms(self, message_text: str, preferences: List[str]) -> Dict[str, int]:
+        """Per-term hit counts from one pass of the compiled preference matcher"""
+        matcher = get_keyword_matcher(self._preference_terms(preferences))
+        return matcher.count(message_text.lower())
+    
+    def _keyword_match_score(
+        self,
+        message_text: str,
+        preferences: List[str],
+        term_hits: Optional[Dict[str, int]] = None
+    ) -> float:
         """Enhanced keyword matching with better fuzzy logic"""
         score = 0.0
-        message_lower = message_text.lower()
-        
-        # Create keyword mappings for better matching
-        keyword_expansions = {
-            'job opportunities': ['job', 'hiring', 'career', 'employment', 'position', 'vacancy', 'work', 'internship', 'recruit'],
-            'study materials': ['study', 'course', 'tutorial', 'learning', 'education', 'lecture', 'pdf', 'notes', 'exam', 'test'],
-            'physics': ['physics', 'quantum', 'mechanics', 'thermodynamics', 'relativity', 'particle', 'motion', 'energy'],
-            'technology': ['tech', 'software', 'hardware', 'ai', 'programming', 'code', 'computer', 'app', 'digital', 'cyber', 'data', 'algorithm'],
-            'business': ['business', 'startup', 'entrepreneur', 'funding', 'investment', 'market', 'sales', 'revenue'],
-            'donald trump': ['trump', 'donald trump', 'president trump']
-        }
+        if term_hits is None:
+            term_hits = self.match_preference_terms(message_text, preferences)
+        
+        def present(term: str) -> bool:
+            # An empty term is a substring of everything
+            return not term or term in term_hits
         
         for pref in preferences:
             pref_lower = pref.lower()
             
             # Exact phrase match - highest score
-            if pref_lower in message_lower:
+            if present(pref_lower):
                 score += 2.0
                 continue
             
             # Check expanded keywords
-            if pref_lower in keyword_expansions:
-                keywords = keyword_expansions[pref_lower]
-                matches = sum(1 for keyword in keywords if keyword in message_lower)
+            if pref_lower in self.KEYWORD_EXPANSIONS:
+                keywords = self.KEYWORD_EXPANSIONS[pref_lower]
+                matches = sum(1 for keyword in keywords if present(keyword))
                 if matches > 0:
                     score += min(matches * 0.5, 1.5)  # Cap at 1.5 per preference
                     continue
@@ -58,29 +81,84 @@ class MessageFilter:
             words = pref_lower.split()
             relevant_words = [w for w in words if len(w) > 3]  # Skip short words
             if relevant_words:
-                matches = sum(1 for word in relevant_words if word in message_lower)
+                matches = sum(1 for word in relevant_words if present(word))
                 if matches > 0:
                     score += (matches / len(relevant_words)) * 0.8
         
         return min(score, 3.0)  # Normalize to 0-3 (to give keyword matching more weight)
     
-    def _tfidf_similarity_score(self, message_text: str, preferences: List[str]) -> float:
-        """Calculate TF-IDF similarity"""
+    def _tfidf_similarity_scores(self, message_texts: List[str], preferences: List[str]) -> np.ndarray:
+        """
+        Corpus-level TF-IDF similarity for a whole batch of messages.
+        Fits one vocabulary over preferences + all messages and scores every
+        message against the preferences with a single sparse dot product.
+        """
+        scores = np.zeros(len(message_texts), dtype=np.float64)
+        if not message_texts or not preferences:
+            return scores
+        
         try:
-            # Combine preferences into one text
             preference_text = ' '.join(preferences)
             
-            # Create corpus
-            corpus = [preference_text, message_text]
-            
-            # Calculate TF-IDF
-            tfidf_matrix = self.vectorizer.fit_transform(corpus)
+            # No max_features cap here: with a large corpus the cap could
+            # drop the preference terms themselves
+            vectorizer = self._make_vectorizer()
+            tfidf_matrix = vectorizer.fit_transform([preference_text] + message_texts)
             
-            # Calculate similarity
-            similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
-            return float(similarity)
-        except:
-            return 0.0
+            # Rows are L2-normalized, so the dot product is the cosine similarity
+            similarities = tfidf_matrix[1:] @ tfidf_matrix[0].T
+            scores[:] = similarities.toarray().ravel()
+        except ValueError:
+            # Empty vocabulary (e.g. only stop words)
+            pass
+        
+        return scores
+    
+    def extract_features(
+        self,
+        messages: List[Dict[str, Any]],
+        preferences: List[str],
+        keyword_weight: float = 0.7,
+        tfidf_weight: float = 0.3
+    ) -> List[MessageFeatures]:
+        """
+        Build the shared feature record for every message: normalized text,
+        preference term hits, keyword score, TF-IDF similarity and the
+        combined importance score. Each is computed exactly once.
+        """
+        features = [MessageFeatures(msg) for msg in messages]
+        if not preferences:
+            return features
+        
+        matcher = get_keyword_matcher(self._preference_terms(preferences))
+        tfidf_scores = self._tfidf_similarity_scores([f.text for f in features], preferences)
+        
+        for feature, tfidf_score in zip(features, tfidf_scores):
+            feature.term_hits = matcher.count(feature.text)
+            feature.keyword_score = self._keyword_match_score(
+                feature.text,
+                preferences,
+                term_hits=feature.term_hits
+            )
+            feature.tfidf_similarity = float(tfidf_score)
+            # Normalize keyword score to 0-1 range (divide by 3)
+            feature.importance_score = (
+                (keyword_weight * feature.keyword_score / 3.0) +
+                (tfidf_weight * feature.tfidf_similarity)
+            )
+        
+        return features
+    
+    def calculate_importance_scores(
+        self,
+        messages: List[Dict[str, Any]],
+        preferences: List[str],
+        keyword_weight: float = 0.7,
+        tfidf_weight: float = 0.3
+    ) -> List[float]:
+        """Calculate combined importance scores for a batch of messages"""
+        features = self.extract_features(messages, preferences, keyword_weight, tfidf_weight)
+        return [f.importance_score for f in features]
     
     def calculate_importance_score(
         self, 
@@ -89,33 +167,57 @@ class MessageFilter:
         keyword_weight: float = 0.7,
         tfidf_weight: float = 0.3
     ) -> float:
-        """Calculate combined importance score"""
+        """Calculate combined importance score (same scorer as the batch path)"""
         if not preferences:
             return 0.0
-            
-        message_text = self._extract_text_from_message(message)
+        return self.calculate_importance_scores([message], preferences, keyword_weight, tfidf_weight)[0]
+    
+    def rank_features(
+        self,
+        features: List[MessageFeatures],
+        threshold: float = 0.15,
+        top_k: Optional[int] = 30
+    ) -> Dict[str, List[MessageFeatures]]:
+        """Split feature records into important and regular by importance score"""
+        # Sort by score
+        ranked = sorted(features, key=lambda f: f.importance_score, reverse=True)
+        
+        # Split into important and regular
+        important = [f for f in ranked if f.importance_score >= threshold]
+        regular = [f for f in ranked if f.importance_score < threshold]
         
-        # Calculate both scores
-        keyword_score = self._keyword_match_score(message_text, preferences)
-        tfidf_score = self._tfidf_similarity_score(message_text, preferences)
+        # Limit important messages if top_k specified
+        if top_k and len(important) > top_k:
+            regular = important[top_k:] + regular
+            important = important[:top_k]
         
-        # Weighted combination
-        # Normalize keyword score to 0-1 range (divide by 3)
-        normalized_keyword = keyword_score / 3.0
-        final_score = (keyword_weight * normalized_keyword) + (tfidf_weight * tfidf_score)
+        # Debug logging
+        print(f"\n📊 Filtering Results:")
+        print(f"   Total messages: {len(features)}")
+        print(f"   Important (score >= {threshold}): {len(important)}")
+        print(f"   Regular: {len(regular)}")
+        if important:
+            top_scores = [f"{f.importance_score:.3f}" for f in important[:3]]
+            print(f"   Top 3 important scores: {top_scores}")
         
-        return final_score
+        return {
+            'important': important,
+            'regular': regular
+        }
     
     def filter_important_messages(
         self,
         messages: List[Dict[str, Any]],
         preferences: List[str],
         threshold: float = 0.15,  # Lowered from 0.3
-        top_k: int = 30  # Show top 30 important messages max
+        top_k: int = 30,  # Show top 30 important messages max
+        features: Optional[List[MessageFeatures]] = None
     ) -> Dict[str, List[Dict[str, Any]]]:
         """
         Filter messages into important and regular
         
+        Pass precomputed `features` (from extract_features) to skip rescoring.
+        
         Returns:
             {
                 'important': [...],  # High relevance messages
@@ -125,43 +227,19 @@ class MessageFilter:
         if not preferences:
             return {'important': [], 'regular': messages}
         
-        # Calculate scores for all messages
-        scored_messages = []
-        for msg in messages:
-            score = self.calculate_importance_score(msg, preferences)
-            msg_copy = msg.copy()
-            msg_copy['importance_score'] = score
-            scored_messages.append(msg_copy)
-        
-        # Sort by score
-        scored_messages.sort(key=lambda x: x['importance_score'], reverse=True)
-        
-        # Split into important and regular
-        important = []
-        regular = []
+        if features is None:
+            features = self.extract_features(messages, preferences)
         
-        for msg in scored_messages:
-            if msg['importance_score'] >= threshold:
-                important.append(msg)
-            else:
-                regular.append(msg)
+        ranked = self.rank_features(features, threshold, top_k)
         
-        # Limit important messages if top_k specified
-        if top_k and len(important) > top_k:
-            regular = important[top_k:] + regular
-            important = important[:top_k]
-        
-        # Debug logging
-        print(f"\n📊 Filtering Results:")
-        print(f"   Total messages: {len(messages)}")
-        print(f"   Important (score >= {threshold}): {len(important)}")
-        print(f"   Regular: {len(regular)}")
-        if important:
-            print(f"   Top 3 important scores: {[f'{m['importance_score']:.3f}' for m in important[:3]]}")
+        def with_score(feature: MessageFeatures) -> Dict[str, Any]:
+            msg_copy = feature.message.copy()
+            msg_copy['importance_score'] = feature.importance_score
+            return msg_copy
         
         return {
-            'important': important,
-            'regular': regular
+            'important': [with_score(f) for f in ranked['important']],
+            'regular': [with_score(f) for f in ranked['regular']]
         }
 
 # Singleton instance
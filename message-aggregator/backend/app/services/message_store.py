@@ -0,0 +1,293 @@
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MESSAGE_STORE_PATH = os.getenv(
+    'MESSAGE_STORE_PATH',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'messages.db')
+)
+
+SHARED_USER = '_shared'  # Messages from bot-level connectors are visible to everyone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    user_key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    title TEXT,
+    content TEXT,
+    sender TEXT,
+    chat TEXT,
+    timestamp TEXT,
+    sort_ts REAL NOT NULL,
+    fetched_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (user_key, id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_platform_ts ON messages (user_key, platform, sort_ts DESC);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    title, content, sender, chat,
+    content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, title, content, sender, chat)
+    VALUES (new.rowid, new.title, new.content, new.sender, new.chat);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, title, content, sender, chat)
+    VALUES ('delete', old.rowid, old.title, old.content, old.sender, old.chat);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, title, content, sender, chat)
+    VALUES ('delete', old.rowid, old.title, old.content, old.sender, old.chat);
+    INSERT INTO messages_fts(rowid, title, content, sender, chat)
+    VALUES (new.rowid, new.title, new.content, new.sender, new.chat);
+END;
+"""
+
+# A preview (body_loaded: false, e.g. a Gmail snippet) never overwrites a full body already stored
+KEEP_LOADED_BODY = (
+    "json_extract(excluded.data, '$.body_loaded') = 0"
+    " AND json_extract(messages.data, '$.body_loaded') = 1"
+)
+
+
+def _sort_timestamp(timestamp: Any, fallback: float) -> float:
+    """Epoch seconds from ISO-8601 or RFC 2822 (Gmail Date header) timestamps"""
+    if not timestamp:
+        return fallback
+    text = str(timestamp)
+    try:
+        parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return fallback
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class MessageStore:
+    """
+    Local SQLite (WAL) store of aggregated messages, keyed by the existing
+    platform-prefixed message ids, with an FTS5 index over
+    title/content/sender/chat. Fetchers upsert; the API reads and searches
+    history without touching upstream APIs.
+    """
+
+    def __init__(self, path: str = MESSAGE_STORE_PATH):
+        self.path = path
+        self.fts_enabled = True
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread (fetchers upsert from worker threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self._initialize()
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _initialize(self):
+        with self._init_lock:
+            if self._initialized:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+                try:
+                    conn.executescript(FTS_SCHEMA)
+                except sqlite3.OperationalError as e:
+                    # SQLite built without FTS5: search falls back to LIKE
+                    print(f"⚠️  FTS5 unavailable, message search will be slower: {e}")
+                    self.fts_enabled = False
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized = True
+            print(f"✅ Message store ready at {self.path}")
+
+    def upsert_messages(self, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> int:
+        """Insert or update messages; returns how many were written"""
+        return len(self._upsert(messages, user_id)[0])
+
+    def upsert_new_messages(self, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Insert or update messages; returns the ones that weren't stored before"""
+        return self._upsert(messages, user_id)[1]
+
+    def _upsert(self, messages: List[Dict[str, Any]], user_id: Optional[str]):
+        if not messages:
+            return [], []
+
+        now = time.time()
+        user_key = user_id or SHARED_USER
+        rows = [
+            (
+                user_key,
+                msg['id'],
+                msg.get('platform', ''),
+                str(msg.get('title', '') or ''),
+                str(msg.get('content', '') or ''),
+                str(msg.get('sender', '') or ''),
+                str(msg.get('chat', '') or ''),
+                str(msg.get('timestamp', '') or ''),
+                _sort_timestamp(msg.get('timestamp'), now),
+                now,
+                json.dumps(msg, default=str)
+            )
+            for msg in messages if msg.get('id')
+        ]
+
+        conn = self._connection()
+        with conn:
+            ids = [row[1] for row in rows]
+            existing = set()
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                existing.update(r[0] for r in conn.execute(
+                    f"SELECT id FROM messages WHERE user_key = ? AND id IN ({', '.join('?' for _ in chunk)})",
+                    (user_key, *chunk)
+                ))
+            conn.executemany(
+                """
+                INSERT INTO messages
+                    (user_key, id, platform, title, content, sender, chat, timestamp, sort_ts, fetched_at, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_key, id) DO UPDATE SET
+                    title = excluded.title,
+                    content = CASE WHEN {keep_body} THEN messages.content ELSE excluded.content END,
+                    sender = excluded.sender,
+                    chat = excluded.chat,
+                    timestamp = excluded.timestamp,
+                    sort_ts = excluded.sort_ts,
+                    fetched_at = excluded.fetched_at,
+                    data = CASE WHEN {keep_body} THEN messages.data ELSE excluded.data END
+                """.format(keep_body=KEEP_LOADED_BODY),
+                rows
+            )
+        new_messages = [msg for msg in messages if msg.get('id') and msg['id'] not in existing]
+        return rows, new_messages
+
+    def has_messages(self, platform: str, user_id: Optional[str] = None) -> bool:
+        """Whether anything from platform is stored for user_id (False on a cold store)"""
+        row = self._connection().execute(
+            "SELECT 1 FROM messages WHERE user_key = ? AND platform = ? LIMIT 1",
+            (user_id or SHARED_USER, platform)
+        ).fetchone()
+        return row is not None
+
+    def recent_messages(
+        self,
+        platforms: List[str],
+        limit: int = 20,
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Newest `limit` stored messages per platform, visible to user_id"""
+        user_keys = (user_id or SHARED_USER, SHARED_USER)
+        conn = self._connection()
+        messages = []
+        for platform in platforms:
+            rows = conn.execute(
+                """
+                SELECT data FROM messages
+                WHERE user_key IN (?, ?) AND platform = ?
+                ORDER BY sort_ts DESC
+                LIMIT ?
+                """,
+                (*user_keys, platform, limit)
+            ).fetchall()
+            messages.extend(json.loads(row[0]) for row in rows)
+        return self._dedupe(messages)
+
+    def search(
+        self,
+        query: str,
+        platforms: Optional[List[str]] = None,
+        limit: int = 50,
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Full-text search over title/content/sender/chat, best matches first"""
+        if not query or not query.strip():
+            return []
+
+        user_keys = (user_id or SHARED_USER, SHARED_USER)
+        platform_filter = ''
+        params: List[Any] = []
+
+        if self.fts_enabled:
+            # Quote every term so user input can't break FTS query syntax
+            fts_query = ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+            sql = """
+                SELECT m.data FROM messages_fts
+                JOIN messages m ON m.rowid = messages_fts.rowid
+                WHERE messages_fts MATCH ? AND m.user_key IN (?, ?)
+            """
+            params = [fts_query, *user_keys]
+            order = "ORDER BY bm25(messages_fts), m.sort_ts DESC"
+        else:
+            pattern = f"%{query.strip()}%"
+            sql = """
+                SELECT m.data FROM messages m
+                WHERE (m.title LIKE ? OR m.content LIKE ? OR m.sender LIKE ? OR m.chat LIKE ?)
+                  AND m.user_key IN (?, ?)
+            """
+            params = [pattern, pattern, pattern, pattern, *user_keys]
+            order = "ORDER BY m.sort_ts DESC"
+
+        if platforms:
+            platform_filter = f" AND m.platform IN ({', '.join('?' for _ in platforms)})"
+            params.extend(platforms)
+
+        rows = self._connection().execute(
+            f"{sql}{platform_filter} {order} LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        return self._dedupe(json.loads(row[0]) for row in rows)
+
+    def get_message(self, message_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """A single stored message visible to user_id"""
+        row = self._connection().execute(
+            "SELECT data FROM messages WHERE id = ? AND user_key IN (?, ?) LIMIT 1",
+            (message_id, user_id or SHARED_USER, SHARED_USER)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _dedupe(messages) -> List[Dict[str, Any]]:
+        """The same id can exist in a user's scope and the shared scope"""
+        seen = set()
+        unique = []
+        for msg in messages:
+            if msg['id'] not in seen:
+                seen.add(msg['id'])
+                unique.append(msg)
+        return unique
+
+    def delete_user_messages(self, user_id: str):
+        """Drop a user's private messages (e.g. credentials revoked)"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE user_key = ?", (user_id,))
+
+
+# Singleton instance
+message_store = MessageStore()
@@ -0,0 +1,202 @@
+from typing import List, Dict, Any, Optional
+import asyncio
+import json
+import os
+import random
+import time
+from app.services.firebase_service import FirebaseService
+from app.services.response_cache import response_cache
+
+ALL_PLATFORMS = ['telegram', 'twitter', 'gmail', 'reddit', 'slack', 'discord']
+
+# Seconds between upstream refreshes per platform (override with PREFETCH_INTERVALS='{"slack": 30}')
+DEFAULT_INTERVALS = {
+    'gmail': 120,
+    'slack': 60,
+    'discord': 60,
+    'telegram': 90,
+    'reddit': 300,
+    'twitter': 300,
+}
+PREFETCH_INTERVALS = {**DEFAULT_INTERVALS, **json.loads(os.getenv('PREFETCH_INTERVALS', '{}'))}
+PREFETCH_MAX_CONCURRENCY = int(os.getenv('PREFETCH_MAX_CONCURRENCY', '4'))
+PREFETCH_ACTIVE_WINDOW = float(os.getenv('PREFETCH_ACTIVE_WINDOW', '1800'))
+PREFETCH_JITTER = float(os.getenv('PREFETCH_JITTER', '0.2'))
+
+# Matches the parameters the dashboard sends to /messages
+DEFAULT_FEED_PARAMS = {
+    'twitter_keyword': 'python',
+    'reddit_keyword': 'technology',
+    'reddit_subreddit': 'all',
+    'limit': 20,
+    'filter_by_preferences': True,
+    'from_store': False,
+}
+
+
+class PrefetchScheduler:
+    """
+    Keeps feeds of recently active users warm.
+    Each platform is refreshed upstream on its own (jittered) interval, then
+    the curated feed is rebuilt from the message store and put in the
+    response cache under the key the user's /messages request uses.
+    """
+
+    def __init__(
+        self,
+        intervals: Dict[str, float] = PREFETCH_INTERVALS,
+        max_concurrency: int = PREFETCH_MAX_CONCURRENCY,
+        active_window: float = PREFETCH_ACTIVE_WINDOW,
+        jitter: float = PREFETCH_JITTER,
+        tick: float = 5.0
+    ):
+        self.intervals = intervals
+        self.max_concurrency = max_concurrency
+        self.active_window = active_window
+        self.jitter = jitter
+        self.tick = tick
+
+        self._aggregator = None
+        self._task: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # user_id -> {'platforms': [...], 'params': {...}, 'last_seen': float}
+        self._feeds: Dict[str, Dict[str, Any]] = {}
+        self._next_due: Dict[tuple, float] = {}
+        self._last_refresh: Dict[str, float] = {}
+        self._running: set = set()
+
+    def start(self, aggregator):
+        """Start the scheduling loop (call from app startup)"""
+        if self._task is not None:
+            return
+        self._aggregator = aggregator
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Prefetch scheduler started (max {self.max_concurrency} concurrent refreshes)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def touch(self, user_id: Optional[str], platforms: List[str], params: Dict[str, Any]):
+        """Record that a user just requested their feed with these parameters"""
+        if not user_id:
+            return
+        self._feeds[user_id] = {
+            'platforms': list(platforms),
+            'params': dict(params),
+            'last_seen': time.monotonic()
+        }
+
+    def prefetch_now(self, user_id: Optional[str], min_age: float = 30.0):
+        """Refresh a user's feed right away (login, setup completed)"""
+        if not user_id or self._task is None or user_id in self._running:
+            return
+        if time.monotonic() - self._last_refresh.get(user_id, float('-inf')) < min_age:
+            return
+        self._start_refresh(user_id, None)
+
+    async def _run(self):
+        while True:
+            try:
+                self._schedule_due()
+            except Exception as e:
+                print(f"❌ Prefetch scheduler error: {e}")
+            await asyncio.sleep(self.tick)
+
+    def _schedule_due(self):
+        now = time.monotonic()
+        for user_id in list(self._feeds):
+            feed = self._feeds[user_id]
+            if now - feed['last_seen'] > self.active_window:
+                # Inactive: stop refreshing until the user comes back
+                del self._feeds[user_id]
+                for platform in feed['platforms']:
+                    self._next_due.pop((user_id, platform), None)
+                continue
+            if user_id in self._running:
+                continue
+
+            due = [
+                p for p in feed['platforms']
+                if self._next_due.get((user_id, p), 0.0) <= now
+            ]
+            if due:
+                self._start_refresh(user_id, due)
+
+    def _start_refresh(self, user_id: str, due_platforms: Optional[List[str]]):
+        self._running.add(user_id)
+        task = asyncio.create_task(self._refresh_user(user_id, due_platforms))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _refresh_user(self, user_id: str, due_platforms: Optional[List[str]]):
+        try:
+            async with self._semaphore:
+                # Before reading profile/credentials: a result computed across an invalidation isn't cached
+                generation = response_cache.generation(user_id)
+                profile = await asyncio.to_thread(FirebaseService.get_user_profile, user_id) or {}
+                feed = self._feeds.get(user_id) or {
+                    'platforms': profile.get('services') or ALL_PLATFORMS,
+                    'params': dict(DEFAULT_FEED_PARAMS)
+                }
+                platforms = feed['platforms']
+                params = feed['params']
+                due = due_platforms if due_platforms is not None else platforms
+
+                preferences = profile.get('preferences', []) if params.get('filter_by_preferences') else []
+
+                print(f"🔄 Prefetching {due} for user {user_id}")
+                started = time.monotonic()
+
+                # Upstream only for due platforms; the feed itself is rebuilt from the store
+                await self._aggregator.fetch_platforms(
+                    due,
+                    params['twitter_keyword'],
+                    params['reddit_keyword'],
+                    params['reddit_subreddit'],
+                    params['limit'],
+                    user_id
+                )
+                result = await self._aggregator.aggregate_messages_async(
+                    selected_platforms=platforms,
+                    user_preferences=preferences if params.get('filter_by_preferences') else None,
+                    twitter_keyword=params['twitter_keyword'],
+                    reddit_keyword=params['reddit_keyword'],
+                    reddit_subreddit=params['reddit_subreddit'],
+                    limit=params['limit'],
+                    filter_by_preferences=params.get('filter_by_preferences', False),
+                    user_id=user_id,
+                    from_store=True
+                )
+                response_cache.put(
+                    response_cache.make_key(user_id, platforms, preferences, **params),
+                    result,
+                    generation
+                )
+
+                self._last_refresh[user_id] = time.monotonic()
+                print(f"✅ Prefetched feed for {user_id} in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            print(f"❌ Prefetch failed for user {user_id}: {e}")
+        finally:
+            # Failed refreshes wait a full interval too, so errors don't retry every tick
+            feed = self._feeds.get(user_id)
+            self._reschedule(user_id, due_platforms or (feed['platforms'] if feed else []))
+            self._running.discard(user_id)
+
+    def _reschedule(self, user_id: str, platforms: List[str]):
+        now = time.monotonic()
+        for platform in platforms:
+            interval = self.intervals.get(platform, 120)
+            self._next_due[(user_id, platform)] = now + interval * (
+                1 + random.uniform(-self.jitter, self.jitter)
+            )
+
+
+# Singleton instance
+prefetch_scheduler = PrefetchScheduler()
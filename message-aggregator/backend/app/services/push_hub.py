@@ -0,0 +1,186 @@
+from typing import List, Dict, Any, Optional, Set
+from collections import OrderedDict, deque
+import asyncio
+import json
+import os
+import time
+
+WS_QUEUE_SIZE = int(os.getenv('WS_QUEUE_SIZE', '100'))
+WS_SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+WS_HEARTBEAT_INTERVAL = float(os.getenv('WS_HEARTBEAT_INTERVAL', '20'))
+WS_IDLE_TIMEOUT = float(os.getenv('WS_IDLE_TIMEOUT', '60'))
+# Message ids remembered as already pushed (live events and store upserts both publish)
+WS_RECENT_IDS = int(os.getenv('WS_RECENT_IDS', '5000'))
+
+
+class PushConnection:
+    """
+    One WebSocket client: a bounded outbound queue drained by its own
+    writer task. When the queue is full the oldest frame is dropped and the
+    client is told how many it missed (one 'resync' frame), so a slow
+    client only ever falls behind itself.
+    """
+
+    def __init__(self, websocket, user_id: Optional[str], queue_size: int = WS_QUEUE_SIZE):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.last_seen = time.monotonic()
+        self.dropped = 0
+        self.closed = False
+        self._queue: deque = deque(maxlen=queue_size)
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: str):
+        """Never blocks; on overflow the oldest queued frame is dropped"""
+        if self.closed:
+            return
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(frame)
+        self._wakeup.set()
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._queue:
+                    if self.dropped:
+                        # Coalesce everything missed into one notice; the client refetches /messages
+                        dropped, self.dropped = self.dropped, 0
+                        await self._send(json.dumps({'type': 'resync', 'dropped': dropped}))
+                    await self._send(self._queue.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Slow or gone: closing ends the reader, which unregisters the connection
+            self.closed = True
+            try:
+                await self.websocket.close(code=1011)
+            except Exception:
+                pass
+
+    async def _send(self, frame: str):
+        await asyncio.wait_for(self.websocket.send_text(frame), WS_SEND_TIMEOUT)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self._wakeup.set()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class PushHub:
+    """
+    Fans newly ingested messages out to WebSocket clients.
+    Publishing serializes a frame once and only enqueues it per connection,
+    so one slow client never delays the others. Messages for a user go to
+    that user's connections; shared messages go to everyone. A message id
+    is pushed once, whichever path (gateway event or store upsert) sees it first.
+    """
+
+    def __init__(self):
+        self._connections: Set[PushConnection] = set()
+        self._by_user: Dict[str, Set[PushConnection]] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        # (user_id or None, message id) of recently pushed messages, oldest first
+        self._recent: "OrderedDict[tuple, None]" = OrderedDict()
+        self._stats = {'published': 0, 'evicted': 0, 'duplicates': 0}
+
+    def start(self):
+        """Start heartbeats / idle eviction (call from app startup)"""
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for conn in list(self._connections):
+            await self.unregister(conn, code=1001)
+
+    def register(self, websocket, user_id: Optional[str]) -> PushConnection:
+        conn = PushConnection(websocket, user_id)
+        conn.start()
+        self._connections.add(conn)
+        if user_id:
+            self._by_user.setdefault(user_id, set()).add(conn)
+        return conn
+
+    def set_user(self, conn: PushConnection, user_id: str):
+        """Route a connection's per-user pushes to user_id (after authentication)"""
+        if conn.user_id == user_id or conn not in self._connections:
+            return
+        self._drop_user(conn)
+        conn.user_id = user_id
+        self._by_user.setdefault(user_id, set()).add(conn)
+
+    def _drop_user(self, conn: PushConnection):
+        if conn.user_id:
+            user_conns = self._by_user.get(conn.user_id)
+            if user_conns is not None:
+                user_conns.discard(conn)
+                if not user_conns:
+                    del self._by_user[conn.user_id]
+
+    async def unregister(self, conn: PushConnection, code: int = 1000):
+        if conn not in self._connections:
+            return
+        self._connections.discard(conn)
+        self._drop_user(conn)
+        await conn.close(code)
+
+    def publish(self, payload: Dict[str, Any], user_id: Optional[str] = None):
+        """Queue payload for one user's connections, or for everyone"""
+        targets = self._by_user.get(user_id, ()) if user_id else self._connections
+        if not targets:
+            return
+        frame = json.dumps(payload, default=str)
+        for conn in list(targets):
+            conn.enqueue(frame)
+        self._stats['published'] += 1
+
+    def publish_messages(self, messages: List[Dict[str, Any]], user_id: Optional[str] = None):
+        fresh = []
+        for msg in messages:
+            key = (user_id, msg.get('id'))
+            if key in self._recent:
+                self._stats['duplicates'] += 1
+                continue
+            self._recent[key] = None
+            fresh.append(msg)
+        while len(self._recent) > WS_RECENT_IDS:
+            self._recent.popitem(last=False)
+        if fresh:
+            self.publish({'type': 'messages', 'messages': fresh}, user_id)
+
+    async def _heartbeat_loop(self):
+        ping = json.dumps({'type': 'ping'})
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            for conn in list(self._connections):
+                if conn.closed or now - conn.last_seen > WS_IDLE_TIMEOUT:
+                    self._stats['evicted'] += 1
+                    await self.unregister(conn, code=1001)
+                else:
+                    conn.enqueue(ping)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'connections': len(self._connections),
+            'users': len(self._by_user)
+        }
+
+
+# Singleton instance
+push_hub = PushHub()
@@ -1,16 +1,28 @@
-from typing import List, Dict, Any
-import praw
+from typing import List, Dict, Any, Optional
+import asyncio
+import asyncpraw
 import os
 from dotenv import load_dotenv
 from datetime import datetime
-import warnings
-
-# Suppress the async warning
-warnings.filterwarnings('ignore', message='.*PRAW.*asynchronous.*')
 
 load_dotenv()
 
+# Comment fetches in flight per request
+REDDIT_COMMENT_CONCURRENCY = int(os.getenv('REDDIT_COMMENT_CONCURRENCY', '5'))
+# Keyword searches per request ("ai,python" searches both)
+REDDIT_MAX_QUERIES = int(os.getenv('REDDIT_MAX_QUERIES', '4'))
+
+
+def _split_terms(value: str) -> List[str]:
+    return [term.strip() for term in (value or '').split(',') if term.strip()]
+
+
 class RedditService:
+    """
+    Async Reddit connector (asyncpraw) on one shared client session.
+    Keyword searches and per-post comment fetches run concurrently.
+    """
+    
     def __init__(self):
         client_id = os.getenv("REDDIT_CLIENT_ID")
         client_secret = os.getenv("REDDIT_CLIENT_SECRET")
@@ -18,88 +30,59 @@ class RedditService:
         if not client_id or not client_secret:
             raise Exception("Reddit credentials not set in .env file")
             
-        self.reddit = praw.Reddit(
+        self.reddit = asyncpraw.Reddit(
             client_id=client_id,
             client_secret=client_secret,
-            user_agent="message_aggregator/1.0 by /u/yourusername",
-            check_for_async=False
+            user_agent="message_aggregator/1.0 by /u/yourusername"
         )
     
-    def fetch_messages(self, keyword: str = "technology", subreddit_name: str = "all", limit: int = 20) -> List[Dict[str, Any]]:
-        """Fetch Reddit posts and comments based on keyword"""
+    async def fetch_messages(self, keyword: str = "technology", subreddit_name: str = "all", limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Fetch Reddit posts and their top comment for one or more keywords
+        (comma-separated) across one or more subreddits (comma-separated).
+        """
         messages = []
         
         try:
-            print(f"🔍 Searching Reddit for '{keyword}' in r/{subreddit_name}...")
+            keywords = _split_terms(keyword)[:REDDIT_MAX_QUERIES] or ["technology"]
+            # Reddit searches several subreddits at once as r/a+b
+            subreddit_path = '+'.join(_split_terms(subreddit_name)) or 'all'
+            print(f"🔍 Searching Reddit for {keywords} in r/{subreddit_path}...")
             
-            subreddit = self.reddit.subreddit(subreddit_name)
+            subreddit = await self.reddit.subreddit(subreddit_path)
+            max_posts = max(1, limit // 2)
             
-            # ⚡ OPTIMIZATION 1: Reduce search results to 5 posts max
-            max_posts = min(5, limit // 2)
+            searches = await asyncio.gather(*(
+                self._search(subreddit, kw, max_posts) for kw in keywords
+            ), return_exceptions=True)
             
-            # ⚡ OPTIMIZATION 2: Add timeout for search
-            results = subreddit.search(
-                keyword, 
-                sort="relevance",  # Changed from "hot" for faster results
-                time_filter="day",  # Changed from "week" to "day" for faster search
-                limit=max_posts
-            )
-            
-            post_count = 0
-            for post in results:
-                post_count += 1
-                print(f"  📄 Processing post {post_count}/{max_posts}: {post.title[:50]}...")
-                
-                # Add the post itself as a message
-                post_message = {
-                    'id': f'reddit_post_{post.id}',
-                    'platform': 'reddit',
-                    'title': post.title,
-                    'content': post.selftext if post.selftext else f"Score: {post.score} | Comments: {post.num_comments}",
-                    'sender': f"u/{post.author.name}" if post.author else "deleted",
-                    'timestamp': datetime.fromtimestamp(post.created_utc).isoformat(),
-                    'url': f"https://www.reddit.com{post.permalink}",
-                    'chat': f"r/{subreddit_name}",
-                    'score': post.score,
-                    'num_comments': post.num_comments
-                }
-                messages.append(post_message)
-                
-                # ⚡ OPTIMIZATION 3: Skip comments if post has too many (causes slowdown)
-                if post.num_comments > 100:
-                    print(f"    ⏩ Skipping comments (too many: {post.num_comments})")
+            posts = []
+            seen = set()
+            for kw, result in zip(keywords, searches):
+                if isinstance(result, Exception):
+                    print(f"⚠️  Reddit search for '{kw}' failed: {result}")
                     continue
-                
-                # ⚡ OPTIMIZATION 4: Only fetch top 1 comment (instead of 2)
-                try:
-                    post.comments.replace_more(limit=0)  # Don't expand "load more comments"
-                    top_comments = list(post.comments)[:1]  # Only 1 comment
-                    
-                    for comment in top_comments:
-                        if hasattr(comment, 'body') and comment.body:
-                            comment_message = {
-                                'id': f'reddit_comment_{comment.id}',
-                                'platform': 'reddit',
-                                'title': f'Comment on: {post.title[:50]}...',
-                                'content': comment.body,
-                                'sender': f"u/{comment.author.name}" if comment.author else "deleted",
-                                'timestamp': datetime.fromtimestamp(comment.created_utc).isoformat(),
-                                'url': f"https://www.reddit.com{comment.permalink}",
-                                'chat': f"r/{subreddit_name}",
-                                'score': comment.score
-                            }
-                            messages.append(comment_message)
-                            print(f"    💬 Added comment from u/{comment.author.name if comment.author else 'deleted'}")
-                            
-                except Exception as e:
-                    print(f"    ⚠️  Error fetching comments: {e}")
-                
-                # ⚡ OPTIMIZATION 5: Stop early if we have enough messages
-                if len(messages) >= limit:
-                    print(f"  ✅ Reached message limit ({limit})")
-                    break
+                for post in result:
+                    if post.id not in seen:
+                        seen.add(post.id)
+                        posts.append(post)
+            
+            # Each post yields itself plus at most one comment: pick the posts that
+            # will be returned before loading any comments
+            posts.sort(key=lambda post: post.created_utc, reverse=True)
+            posts = posts[:max_posts]
             
-            print(f"✅ Fetched {len(messages)} Reddit messages for keyword '{keyword}' in {post_count} posts")
+            semaphore = asyncio.Semaphore(REDDIT_COMMENT_CONCURRENCY)
+            top_comments = await asyncio.gather(*(
+                self._top_comment(post, semaphore) for post in posts
+            ))
+            
+            for post, comment in zip(posts, top_comments):
+                messages.append(self._post_message(post))
+                if comment is not None:
+                    messages.append(self._comment_message(comment, post))
+            
+            print(f"✅ Fetched {len(messages)} Reddit messages for {keywords} in {len(posts)} posts")
             
         except Exception as e:
             print(f"❌ Error fetching Reddit messages: {e}")
@@ -107,13 +90,87 @@ class RedditService:
                 print("⚠️  Reddit API authentication failed. Check your credentials.")
                 print("👉 Make sure REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET are correct")
         
-        return messages
+        return messages[:limit]
+    
+    async def _search(self, subreddit, keyword: str, max_posts: int) -> list:
+        return [
+            post async for post in subreddit.search(
+                keyword,
+                sort="relevance",
+                time_filter="day",
+                limit=max_posts
+            )
+        ]
+    
+    async def _top_comment(self, post, semaphore: asyncio.Semaphore):
+        """First top-level comment of a post, or None"""
+        # Skip comments if post has too many (huge comment payloads)
+        if post.num_comments == 0 or post.num_comments > 100:
+            return None
+        
+        try:
+            async with semaphore:
+                post.comment_limit = 3  # Only the first few comments are downloaded
+                await post.load()
+            await post.comments.replace_more(limit=0)  # Don't expand "load more comments"
+            for comment in post.comments.list()[:1]:
+                if getattr(comment, 'body', None):
+                    return comment
+        except Exception as e:
+            print(f"    ⚠️  Error fetching comments: {e}")
+        return None
+    
+    @staticmethod
+    def _post_message(post) -> Dict[str, Any]:
+        return {
+            'id': f'reddit_post_{post.id}',
+            'platform': 'reddit',
+            'title': post.title,
+            'content': post.selftext if post.selftext else f"Score: {post.score} | Comments: {post.num_comments}",
+            'sender': f"u/{post.author.name}" if post.author else "deleted",
+            'timestamp': datetime.fromtimestamp(post.created_utc).isoformat(),
+            'url': f"https://www.reddit.com{post.permalink}",
+            'chat': f"r/{post.subreddit.display_name}",
+            'score': post.score,
+            'num_comments': post.num_comments
+        }
+    
+    @staticmethod
+    def _comment_message(comment, post) -> Dict[str, Any]:
+        return {
+            'id': f'reddit_comment_{comment.id}',
+            'platform': 'reddit',
+            'title': f'Comment on: {post.title[:50]}...',
+            'content': comment.body,
+            'sender': f"u/{comment.author.name}" if comment.author else "deleted",
+            'timestamp': datetime.fromtimestamp(comment.created_utc).isoformat(),
+            'url': f"https://www.reddit.com{comment.permalink}",
+            'chat': f"r/{post.subreddit.display_name}",
+            'score': comment.score
+        }
+    
+    async def close(self):
+        """Close the shared HTTP session (call from app shutdown)"""
+        await self.reddit.close()
+
+# Global instance (its HTTP session belongs to the app's event loop)
+_reddit_service: Optional[RedditService] = None
+
+def get_reddit_service() -> RedditService:
+    global _reddit_service
+    if _reddit_service is None:
+        _reddit_service = RedditService()
+    return _reddit_service
+
+async def close_reddit_service():
+    if _reddit_service is not None:
+        await _reddit_service.close()
 
-def fetch_reddit_messages(keyword: str = "technology", subreddit: str = "all", limit: int = 20) -> List[Dict[str, Any]]:
+async def fetch_reddit_messages(keyword: str = "technology", subreddit: str = "all", limit: int = 20) -> List[Dict[str, Any]]:
     """Standalone function to fetch Reddit messages"""
     try:
-        service = RedditService()
-        return service.fetch_messages(keyword, subreddit, limit)
+        service = get_reddit_service()
+        return await service.fetch_messages(keyword, subreddit, limit)
     except Exception as e:
         print(f"❌ Reddit service error: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,141 @@
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '30'))
+RESPONSE_CACHE_STALE_TTL = float(os.getenv('RESPONSE_CACHE_STALE_TTL', '300'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '500'))
+
+
+class ResponseCache:
+    """
+    TTL cache for /messages responses with stale-while-revalidate:
+    - younger than ttl: served as-is
+    - younger than ttl + stale_ttl: served immediately, refreshed in the background
+    - older / missing: computed in the request (concurrent misses share one computation)
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        stale_ttl: float = RESPONSE_CACHE_STALE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        # Bumped on invalidation so in-flight refreshes don't store outdated results
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0}
+
+    @staticmethod
+    def make_key(
+        user_id: Optional[str],
+        platforms: List[str],
+        preferences: Optional[List[str]],
+        **params: Any
+    ) -> tuple:
+        """Key on user, platform set, request params and a hash of the preferences"""
+        preferences_hash = hashlib.sha256(
+            json.dumps(sorted(preferences or [])).encode('utf-8')
+        ).hexdigest()[:16]
+        return (
+            user_id or '',
+            tuple(sorted(set(platforms))),
+            preferences_hash,
+            tuple(sorted(params.items()))
+        )
+
+    async def get_or_compute(
+        self,
+        key: tuple,
+        compute: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Tuple[Dict[str, Any], str]:
+        """Return (response, cache status) where status is hit, stale or miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return value, 'hit'
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self._stats['stale_hits'] += 1
+                self._refresh(key, compute)
+                return value, 'stale'
+
+        self._stats['misses'] += 1
+        task = self._refresh(key, compute)
+        # Shield: a cancelled request must not cancel work other waiters share
+        return await asyncio.shield(task), 'miss'
+
+    def _refresh(self, key: tuple, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> asyncio.Task:
+        """Start (or join) the computation for key"""
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats['refreshes'] += 1
+            task = asyncio.create_task(self._compute_and_store(key, compute))
+            # Background refreshes may have no awaiter: retrieve errors so they aren't logged as lost
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+
+    async def _compute_and_store(self, key: tuple, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        generation = self._generation(key[0])
+        try:
+            value = await compute()
+            # Partial responses (platforms past the deadline) aren't cached: the next call picks up the late results
+            if not value.get('partial'):
+                self.put(key, value, generation)
+            return value
+        except Exception as e:
+            print(f"⚠️  Response cache refresh failed: {e}")
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _generation(self, user_key: str) -> Tuple[int, int]:
+        return (self._global_generation, self._generations.get(user_key, 0))
+
+    def generation(self, user_id: Optional[str]) -> Tuple[int, int]:
+        """Invalidation generation to capture before computing a value for put()"""
+        return self._generation(user_id or '')
+
+    def put(self, key: tuple, value: Dict[str, Any], generation: Optional[Tuple[int, int]] = None):
+        """
+        Store value. With the generation captured before computing it, a
+        value computed across an invalidate() (e.g. old credentials) is dropped.
+        """
+        if generation is not None and self._generation(key[0]) != generation:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop cached responses for a user (or everything), e.g. after a preferences change"""
+        if user_id is None:
+            self._entries.clear()
+            self._global_generation += 1
+            return
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        for key in [k for k in self._entries if k[0] == user_id]:
+            del self._entries[key]
+        print(f"🧹 Response cache invalidated for user {user_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'entries': len(self._entries), 'ttl': self.ttl, 'stale_ttl': self.stale_ttl}
+
+
+# Singleton instance
+response_cache = ResponseCache()
@@ -1,37 +1,142 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
 import os
-from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 from slack_sdk.errors import SlackApiError
 from dotenv import load_dotenv
 from datetime import datetime
 import time
+from app.services.sync_state import sync_state
+from app.services.message_store import message_store
+from app.services.rate_limit import TokenBucket
 
 # Force reload environment variables
 load_dotenv(override=True)
 
-class SlackService:
-    def __init__(self):
-        slack_token = os.getenv("SLACK_BOT_TOKEN")
-        
-        # Debug: Print if token is found (first/last 4 chars only)
-        if slack_token:
-            print(f"✅ Slack token found: {slack_token[:10]}...{slack_token[-4:]}")
-        else:
-            print(f"❌ SLACK_BOT_TOKEN environment variable is: {repr(slack_token)}")
-            print(f"📋 All env vars starting with SLACK: {[k for k in os.environ.keys() if k.startswith('SLACK')]}")
-            raise Exception("SLACK_BOT_TOKEN not set in .env file")
-            
-        self.client = WebClient(token=slack_token)
+SLACK_DIRECTORY_TTL = float(os.getenv('SLACK_DIRECTORY_TTL', '600'))
+SLACK_MAX_CHANNELS = int(os.getenv('SLACK_MAX_CHANNELS', '1000'))
+SLACK_MAX_CONCURRENCY = int(os.getenv('SLACK_MAX_CONCURRENCY', '8'))
+# Incremental syncs page back to the channel cursor, at most this many pages per sync
+SLACK_SYNC_PAGE_SIZE = int(os.getenv('SLACK_SYNC_PAGE_SIZE', '200'))
+SLACK_SYNC_MAX_PAGES = int(os.getenv('SLACK_SYNC_MAX_PAGES', '5'))
+SLACK_MAX_RETRIES = 3
+
+# (requests per minute, burst) per Web API method, following Slack's rate limit tiers
+SLACK_METHOD_LIMITS = {
+    'conversations_history': (50, 20),  # Tier 3
+    'conversations_list': (20, 5),      # Tier 2
+    'users_list': (20, 5),              # Tier 2
+    'users_info': (100, 20),            # Tier 4
+}
+
+
+class SlackApi:
+    """
+    AsyncWebClient for one workspace. Every call waits for its method's
+    token bucket; rate-limited calls (429 / ratelimited) pause that bucket
+    for Retry-After seconds and are retried.
+    """
+    
+    def __init__(self, token: str):
+        self.client = AsyncWebClient(token=token)
+        self._buckets = {
+            method: TokenBucket.per_minute(requests, burst)
+            for method, (requests, burst) in SLACK_METHOD_LIMITS.items()
+        }
+        self.directory = SlackDirectory(self)
     
-    def fetch_channels(self, limit: int = 50):
-        """Fetch accessible channels"""
+    async def call(self, method: str, **kwargs):
+        bucket = self._buckets[method]
+        for attempt in range(SLACK_MAX_RETRIES + 1):
+            await bucket.acquire()
+            try:
+                return await getattr(self.client, method)(**kwargs)
+            except SlackApiError as e:
+                rate_limited = e.response.status_code == 429 or e.response.get('error') == 'ratelimited'
+                if not rate_limited or attempt == SLACK_MAX_RETRIES:
+                    raise
+                headers = e.response.headers or {}
+                retry_after = float(headers.get('Retry-After') or headers.get('retry-after') or 1)
+                print(f"⏳ Slack {method} rate limited, retrying in {retry_after:.0f}s")
+                bucket.pause(retry_after)
+
+
+class SlackDirectory:
+    """
+    Users and channels of one workspace, bulk-loaded with users.list and
+    conversations.list and refreshed when older than ttl, so rendering
+    messages never needs a per-message users.info call.
+    
+    Refreshes run in one background task each and swap the new map in when
+    complete; readers keep the previous map meanwhile and only wait for
+    the very first load.
+    """
+    
+    def __init__(self, api: SlackApi, ttl: float = SLACK_DIRECTORY_TTL):
+        self.api = api
+        self.ttl = ttl
+        self._users: Dict[str, str] = {}
+        self._channels: List[Dict[str, Any]] = []
+        self._users_loaded_at = float('-inf')
+        self._channels_loaded_at = float('-inf')
+        self._users_refresh: Optional[asyncio.Task] = None
+        self._channels_refresh: Optional[asyncio.Task] = None
+    
+    async def channels(self) -> List[Dict[str, Any]]:
+        """Accessible, non-archived channels (cached)"""
+        if time.monotonic() - self._channels_loaded_at > self.ttl:
+            if self._channels_refresh is None or self._channels_refresh.done():
+                self._channels_refresh = asyncio.create_task(self._refresh_channels())
+            if self._channels_loaded_at == float('-inf'):
+                await asyncio.shield(self._channels_refresh)
+        return self._channels
+    
+    async def user_name(self, user_id: Optional[str]) -> str:
+        """Display name for a user id, from memory"""
+        if not user_id:
+            return "unknown"
+        if time.monotonic() - self._users_loaded_at > self.ttl:
+            if self._users_refresh is None or self._users_refresh.done():
+                self._users_refresh = asyncio.create_task(self._refresh_users())
+            if self._users_loaded_at == float('-inf'):
+                await asyncio.shield(self._users_refresh)
+        name = self._users.get(user_id)
+        if name is None:
+            # Joined since the last refresh: look up once and remember
+            name = await self._lookup_user(user_id)
+            self._users[user_id] = name
+        return name
+    
+    async def _refresh_users(self):
+        users = {}
+        cursor = None
+        try:
+            while True:
+                response = await self.api.call('users_list', limit=200, cursor=cursor)
+                for member in response.get("members", []):
+                    users[member["id"]] = self._display_name(member)
+                cursor = response.get("response_metadata", {}).get("next_cursor")
+                if not cursor:
+                    break
+            # Keep names looked up individually while the list was paging
+            self._users = {**self._users, **users}
+            print(f"✅ Slack directory: {len(users)} users")
+        except SlackApiError as e:
+            # Keep serving the previous directory
+            print(f"❌ Error listing Slack users: {e.response['error']}")
+        except Exception as e:
+            print(f"❌ Error listing Slack users: {e}")
+        self._users_loaded_at = time.monotonic()
+    
+    async def _refresh_channels(self):
         channels = []
         cursor = None
         try:
-            while len(channels) < limit:
-                response = self.client.conversations_list(
+            while len(channels) < SLACK_MAX_CHANNELS:
+                response = await self.api.call(
+                    'conversations_list',
                     types="public_channel,private_channel,im,mpim",
-                    limit=min(200, limit - len(channels)),
+                    limit=200,
                     cursor=cursor,
                     exclude_archived=True
                 )
@@ -39,84 +144,208 @@ class SlackService:
                 cursor = response.get("response_metadata", {}).get("next_cursor")
                 if not cursor:
                     break
-                time.sleep(0.5)
-            print(f"✅ Found {len(channels)} Slack channels")
+            self._channels = channels[:SLACK_MAX_CHANNELS]
+            print(f"✅ Slack directory: {len(self._channels)} channels")
         except SlackApiError as e:
             print(f"❌ Error fetching Slack channels: {e.response['error']}")
-        return channels[:limit]
+        except Exception as e:
+            print(f"❌ Error fetching Slack channels: {e}")
+        self._channels_loaded_at = time.monotonic()
+    
+    async def _lookup_user(self, user_id: str) -> str:
+        try:
+            response = await self.api.call('users_info', user=user_id)
+            return self._display_name(response['user'])
+        except Exception:
+            return user_id
     
-    def fetch_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
-        """Fetch recent messages from all accessible channels"""
+    @staticmethod
+    def _display_name(member: Dict[str, Any]) -> str:
+        return member.get('real_name') or member.get('name') or member.get('id', 'unknown')
+
+
+# One client (rate limits + directory) per workspace bot token
+_workspaces: Dict[str, SlackApi] = {}
+
+
+def get_slack_api(token: str) -> SlackApi:
+    api = _workspaces.get(token)
+    if api is None:
+        api = SlackApi(token)
+        _workspaces[token] = api
+    return api
+
+
+class SlackService:
+    def __init__(self):
+        slack_token = os.getenv("SLACK_BOT_TOKEN")
+        
+        # Debug: Print if token is found (first/last 4 chars only)
+        if slack_token:
+            print(f"✅ Slack token found: {slack_token[:10]}...{slack_token[-4:]}")
+        else:
+            print(f"❌ SLACK_BOT_TOKEN environment variable is: {repr(slack_token)}")
+            print(f"📋 All env vars starting with SLACK: {[k for k in os.environ.keys() if k.startswith('SLACK')]}")
+            raise Exception("SLACK_BOT_TOKEN not set in .env file")
+            
+        self.api = get_slack_api(slack_token)
+        self.directory = self.api.directory
+    
+    async def fetch_channels(self, limit: int = 50):
+        """Accessible channels, from the workspace directory"""
+        channels = (await self.directory.channels())[:limit]
+        print(f"✅ Found {len(channels)} Slack channels")
+        return channels
+    
+    async def fetch_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Fetch recent messages from all accessible channels concurrently.
+        Channels already synced only return messages newer than their stored ts.
+        Messages fetched beyond `limit` go straight to the message store.
+        """
         all_messages = []
         
         try:
-            channels = self.fetch_channels(limit=20)
+            # Per-channel cursors: {channel_id: latest ts, or {'ts', 'backfill'}}
+            channel_cursors = sync_state.get_cursor(None, 'slack') or {}
+            channels = await self.fetch_channels(limit=20)
             
-            for ch in channels:
-                ch_name = ch.get("name", ch.get("id", "unknown"))
-                ch_id = ch["id"]
-                is_dm = ch.get("is_im", False)
-                
-                if is_dm:
-                    ch_name = f"DM-{ch_name}"
-                
-                try:
-                    response = self.client.conversations_history(
-                        channel=ch_id,
-                        limit=10
-                    )
-                    messages = response.get("messages", [])
-                    
-                    for msg in messages:
-                        # Skip bot messages and system messages
-                        if msg.get("subtype") in ["bot_message", "channel_join", "channel_leave"]:
-                            continue
-                        
-                        message_data = {
-                            'id': f'slack_{ch_id}_{msg.get("ts", "")}',
-                            'platform': 'slack',
-                            'title': f'Message from {ch_name}',
-                            'content': msg.get("text", ""),  # ✅ Full message content
-                            'sender': self._get_user_name(msg.get("user", "unknown")),
-                            'timestamp': datetime.fromtimestamp(float(msg.get("ts", 0))).isoformat(),
-                            'chat': ch_name,
-                            'channel_id': ch_id
-                        }
-                        all_messages.append(message_data)
-                        
-                        if len(all_messages) >= limit:
-                            break
-                    
-                    time.sleep(0.5)
-                    
-                except SlackApiError as e:
-                    error_msg = e.response.get('error', 'unknown_error')
-                    if error_msg not in ["channel_not_found", "not_in_channel"]:
-                        print(f"⚠ Error fetching from {ch_name}: {error_msg}")
-                
-                if len(all_messages) >= limit:
-                    break
+            # Pacing comes from the per-method token buckets, not from sleeps
+            semaphore = asyncio.Semaphore(SLACK_MAX_CONCURRENCY)
+            synced = await asyncio.gather(*(
+                self._sync_channel(ch, channel_cursors.get(ch["id"]), semaphore)
+                for ch in channels
+            ))
+            
+            for ch, (messages, cursor) in zip(channels, synced):
+                if cursor is not None:
+                    channel_cursors[ch["id"]] = cursor
+                all_messages.extend(await self._build_messages(ch, messages))
+            
+            # Newest first across channels
+            all_messages.sort(key=lambda m: m['ts'], reverse=True)
+            for msg in all_messages:
+                del msg['ts']
             
-            print(f"✅ Fetched {len(all_messages)} Slack messages")
+            fetched = all_messages
+            all_messages = sync_state.merge(None, 'slack', fetched, channel_cursors, limit)
+            returned_ids = {msg['id'] for msg in all_messages}
+            overflow = [msg for msg in fetched if msg['id'] not in returned_ids]
+            if overflow:
+                await asyncio.to_thread(message_store.upsert_messages, overflow)
+            print(f"✅ Fetched {len(all_messages)} Slack messages ({len(overflow)} more stored)")
             
         except Exception as e:
             print(f"❌ Error fetching Slack messages: {e}")
         
         return all_messages[:limit]
     
-    def _get_user_name(self, user_id: str) -> str:
-        """Get username from user ID"""
+    async def _sync_channel(
+        self,
+        ch: Dict[str, Any],
+        cursor: Any,
+        semaphore: asyncio.Semaphore
+    ) -> Tuple[List[Dict[str, Any]], Any]:
+        """
+        Raw messages of one channel and its next cursor.
+        The cursor only moves past messages that were actually fetched: a
+        window cut off by SLACK_SYNC_MAX_PAGES is remembered as 'backfill'
+        (oldest, latest) and fetched on the following syncs.
+        """
+        if isinstance(cursor, dict):
+            ts, backfill = cursor.get('ts'), cursor.get('backfill')
+        else:
+            ts, backfill = cursor, None
+        
+        if ts is None:
+            # First sync: the latest page is enough, there is no gap to cover
+            messages, _ = await self._fetch_history(ch, semaphore, limit=10, max_pages=1)
+            return messages, max((m.get("ts", "0") for m in messages), key=float, default=None)
+        
+        messages, complete = await self._fetch_history(ch, semaphore, oldest=ts)
+        newest = max((m.get("ts", "0") for m in messages), key=float, default=ts)
+        
+        gap = None
+        if backfill:
+            older, done = await self._fetch_history(ch, semaphore, oldest=backfill[0], latest=backfill[1])
+            if not done:
+                gap = [backfill[0], min((m["ts"] for m in older), key=float, default=backfill[1])]
+            messages = messages + older
+        if not complete and newest != ts:
+            # Only the newest pages arrived: (ts, oldest fetched) is still missing
+            new_oldest = min((m["ts"] for m in messages if float(m["ts"]) > float(ts)), key=float)
+            gap = [gap[0] if gap else ts, new_oldest]
+        
+        return messages, {'ts': newest, 'backfill': gap} if gap else newest
+    
+    async def _fetch_history(
+        self,
+        ch: Dict[str, Any],
+        semaphore: asyncio.Semaphore,
+        oldest: Optional[str] = None,
+        latest: Optional[str] = None,
+        limit: int = SLACK_SYNC_PAGE_SIZE,
+        max_pages: int = SLACK_SYNC_MAX_PAGES
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Raw messages of one channel, newest first, between oldest and latest
+        (both exclusive), paged up to max_pages. Returns (messages, complete).
+        """
+        history_args = {'channel': ch["id"], 'limit': limit}
+        if oldest:
+            history_args['oldest'] = oldest
+        if latest:
+            history_args['latest'] = latest
+        messages = []
         try:
-            response = self.client.users_info(user=user_id)
-            return response['user']['real_name'] or response['user']['name']
-        except:
-            return user_id
+            for _ in range(max_pages):
+                async with semaphore:
+                    response = await self.api.call('conversations_history', **history_args)
+                messages.extend(response.get("messages", []))
+                next_cursor = response.get("response_metadata", {}).get("next_cursor")
+                if not response.get("has_more") or not next_cursor:
+                    return messages, True
+                history_args['cursor'] = next_cursor
+            return messages, False
+        except SlackApiError as e:
+            error_msg = e.response.get('error', 'unknown_error')
+            if error_msg not in ["channel_not_found", "not_in_channel"]:
+                print(f"⚠ Error fetching from {ch.get('name', ch['id'])}: {error_msg}")
+            # Treated as cut off: the cursor only moves past what was fetched
+            return messages, False
+    
+    async def _build_messages(self, ch: Dict[str, Any], messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        ch_name = ch.get("name", ch.get("id", "unknown"))
+        ch_id = ch["id"]
+        
+        if ch.get("is_im", False):
+            dm_name = await self.directory.user_name(ch["user"]) if ch.get("user") else ch_name
+            ch_name = f"DM-{dm_name}"
+        
+        built = []
+        for msg in messages:
+            # Skip bot messages and system messages
+            if msg.get("subtype") in ["bot_message", "channel_join", "channel_leave"]:
+                continue
+            
+            built.append({
+                'id': f'slack_{ch_id}_{msg.get("ts", "")}',
+                'platform': 'slack',
+                'title': f'Message from {ch_name}',
+                'content': msg.get("text", ""),  # ✅ Full message content
+                'sender': await self.directory.user_name(msg.get("user")),
+                'timestamp': datetime.fromtimestamp(float(msg.get("ts", 0))).isoformat(),
+                'chat': ch_name,
+                'channel_id': ch_id,
+                'ts': float(msg.get("ts", 0))
+            })
+        return built
 
-def fetch_slack_messages(limit: int = 20) -> List[Dict[str, Any]]:
+async def fetch_slack_messages(limit: int = 20) -> List[Dict[str, Any]]:
     """Standalone function to fetch Slack messages"""
     try:
         service = SlackService()
-        return service.fetch_messages(limit)
+        return await service.fetch_messages(limit)
     except Exception as e:
         print(f"❌ Slack fetch error: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,95 @@
+from typing import List, Dict, Any, Optional
+import threading
+# Bot-level connectors (Slack, Telegram, Discord) aren't per user
+from app.services.message_store import SHARED_USER
+
+
+class SyncStateStore:
+    """
+    Per-user, per-source incremental sync state:
+    - cursor: the connector's high-water mark (Gmail historyId, Slack ts per
+      channel, Telegram message id per dialog, Discord snowflake per channel)
+    - messages: the most recent messages already fetched, merged with each
+      incremental batch
+
+    A cursor is only handed out while its messages are held, so a fresh
+    process always starts with a full fetch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursors: Dict[tuple, Any] = {}
+        self._messages: Dict[tuple, List[Dict[str, Any]]] = {}
+
+    @staticmethod
+    def _key(user_id: Optional[str], source: str) -> tuple:
+        return (user_id or SHARED_USER, source)
+
+    def get_cursor(self, user_id: Optional[str], source: str) -> Any:
+        """High-water mark for incremental fetches, or None for a full fetch"""
+        key = self._key(user_id, source)
+        with self._lock:
+            if key not in self._messages:
+                return None
+            cursor = self._cursors.get(key)
+            # Per-channel cursors are mutated by callers: hand out a copy
+            return dict(cursor) if isinstance(cursor, dict) else cursor
+
+    def merge(
+        self,
+        user_id: Optional[str],
+        source: str,
+        new_messages: List[Dict[str, Any]],
+        cursor: Any,
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Merge newly fetched messages (newest first) ahead of the retained ones,
+        de-duplicated by id, store the new cursor and return the first `limit`.
+        """
+        key = self._key(user_id, source)
+        with self._lock:
+            merged = []
+            seen = set()
+            for msg in list(new_messages) + self._messages.get(key, []):
+                if msg['id'] in seen:
+                    continue
+                seen.add(msg['id'])
+                merged.append(msg)
+
+            # Keep a little more than requested so a larger limit next time still has history
+            self._messages[key] = merged[:max(limit * 2, 50)]
+            if cursor is not None:
+                self._cursors[key] = cursor
+            return merged[:limit]
+
+    def forget(self, user_id: Optional[str], source: str):
+        """Drop the state of exactly one source (e.g. an evicted search keyword)"""
+        key = self._key(user_id, source)
+        with self._lock:
+            self._messages.pop(key, None)
+            self._cursors.pop(key, None)
+
+    def reset(self, user_id: Optional[str], source: Optional[str] = None):
+        """
+        Forget state so the next sync is a full fetch (e.g. credentials changed).
+        With a source, its shared state (bot-level connectors, keyed
+        '<source>' or '<source>:<query>') is reset too.
+        """
+        user_key = user_id or SHARED_USER
+
+        def matches(key: tuple) -> bool:
+            if source is None:
+                return key[0] == user_key
+            same_source = key[1] == source or key[1].startswith(f"{source}:")
+            return same_source and key[0] in (user_key, SHARED_USER)
+
+        with self._lock:
+            for key in list(self._messages.keys() | self._cursors.keys()):
+                if matches(key):
+                    self._messages.pop(key, None)
+                    self._cursors.pop(key, None)
+
+
+# Singleton instance
+sync_state = SyncStateStore()
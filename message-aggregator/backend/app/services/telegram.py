@@ -1,9 +1,13 @@
-from typing import List, Dict, Any
-from telethon import TelegramClient
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict, deque
+from telethon import TelegramClient, events, utils
 import asyncio
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+from app.services.sync_state import sync_state
+from app.services.message_store import message_store
+from app.services.push_hub import push_hub
 
 # Force load environment variables
 load_dotenv(override=True)
@@ -19,7 +23,29 @@ print(f"   API_ID: {API_ID}")
 print(f"   API_HASH: {API_HASH[:10] if API_HASH else None}...")
 print(f"   PHONE: {PHONE}")
 
+# Live update buffer bounds
+TELEGRAM_BUFFER_PER_DIALOG = int(os.getenv('TELEGRAM_BUFFER_PER_DIALOG', '50'))
+TELEGRAM_BUFFER_TOTAL = int(os.getenv('TELEGRAM_BUFFER_TOTAL', '1000'))
+# Dialog scan: how many recent dialogs to consider, scan at most, and in parallel
+TELEGRAM_DIALOG_CANDIDATES = int(os.getenv('TELEGRAM_DIALOG_CANDIDATES', '50'))
+TELEGRAM_MAX_DIALOGS = int(os.getenv('TELEGRAM_MAX_DIALOGS', '5'))
+TELEGRAM_SCAN_CONCURRENCY = int(os.getenv('TELEGRAM_SCAN_CONCURRENCY', '4'))
+# Incremental scans read back to the dialog cursor, at most this many messages per sync
+TELEGRAM_SYNC_MAX_MESSAGES = int(os.getenv('TELEGRAM_SYNC_MAX_MESSAGES', '200'))
+# Also write live messages to the local message store
+TELEGRAM_PERSIST_UPDATES = os.getenv('TELEGRAM_PERSIST_UPDATES', 'true').lower() == 'true'
+
 class TelegramService:
+    """
+    Long-lived Telegram client owned by the app's event loop.
+    Connects once (Telethon reconnects automatically on network errors)
+    and keeps sender names in memory so rendering needs no extra requests.
+    
+    New messages are pushed by a NewMessage handler into a bounded buffer
+    (per dialog and overall); after one initial scan, reads are served from
+    the buffer without calling Telegram.
+    """
+    
     def __init__(self):
         # Validate credentials
         if not API_ID or not API_HASH:
@@ -27,80 +53,342 @@ class TelegramService:
             
         # Use absolute path for session file
         session_path = os.path.join(os.path.dirname(__file__), '..', '..', 'session_name')
-        self.client = TelegramClient(session_path, int(API_ID), API_HASH)
+        self.client = TelegramClient(
+            session_path,
+            int(API_ID),
+            API_HASH,
+            auto_reconnect=True,
+            retry_delay=2
+        )
+        self._connect_lock = asyncio.Lock()
+        self.authorized = False
+        # sender id -> display name
+        self._sender_names: Dict[int, str] = {}
+        
+        # message id -> message, oldest first; per dialog: ids in arrival order
+        self._buffer: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._dialog_buffers: Dict[int, deque] = {}
+        self.primed = False
+        self._pending_store: List[Dict[str, Any]] = []
+        self._store_flush: Optional[asyncio.Task] = None
+        
+        self.client.add_event_handler(self._on_new_message, events.NewMessage())
+    
+    async def ensure_connected(self) -> bool:
+        """
+        Connect on first use, or again if automatic reconnects gave up.
+        Never logs in interactively (that would prompt on stdin and block the
+        event loop): the session file must already be authorized.
+        """
+        async with self._connect_lock:
+            if self.client.is_connected() and self.authorized:
+                return True
+            try:
+                print(f"Starting Telegram client...")
+                await self.client.connect()
+                self.authorized = await self.client.is_user_authorized()
+                if not self.authorized:
+                    print(f"❌ Telegram session for {PHONE} is not authorized; log in once outside the server to create it")
+                    await self.client.disconnect()
+                    return False
+                print(f"Telegram client started successfully")
+                # Updates may have been missed while disconnected: rescan on next read
+                self.primed = False
+                try:
+                    await self.client.catch_up()
+                except Exception as e:
+                    print(f"⚠️  Telegram catch-up failed: {e}")
+                return True
+            except Exception as e:
+                print(f"❌ Error starting Telegram client: {e}")
+                return False
+    
+    async def _sender_name(self, message, chat_name: str) -> str:
+        """Sender name from the cache, else from the entity delivered with the message"""
+        name = self._sender_names.get(message.sender_id)
+        if name is not None:
+            return name
+        
+        # iter_messages delivers senders with the batch; get_sender only hits the network if missing
+        sender = message.sender or await message.get_sender()
+        if hasattr(sender, 'first_name'):
+            name = sender.first_name
+            self._sender_names[message.sender_id] = name
+            return name
+        return chat_name
         
     async def fetch_messages_async(self, limit: int = 20) -> List[Dict[str, Any]]:
         messages = []
+        if not await self.ensure_connected():
+            return messages
+        
         try:
-            print(f"Starting Telegram client...")
-            await self.client.start(phone=PHONE)
-            print(f"Telegram client started successfully")
+            # Per-dialog cursors: {dialog_id: last message id, or {'id', 'backfill'}}
+            dialog_cursors = sync_state.get_cursor(None, 'telegram') or {}
+            
+            budget = limit * 5
+            selected = self._select_dialogs(
+                await self.client.get_dialogs(limit=TELEGRAM_DIALOG_CANDIDATES),
+                dialog_cursors
+            )
+            shares = self._split_budget(selected, budget, limit)
+            
+            semaphore = asyncio.Semaphore(TELEGRAM_SCAN_CONCURRENCY)
+            results = await asyncio.gather(*(
+                self._sync_dialog(dialog, share, dialog_cursors.get(dialog.id), semaphore)
+                for dialog, share in zip(selected, shares)
+            ), return_exceptions=True)
             
-            dialog_count = 0
-            async for dialog in self.client.iter_dialogs():
-                dialog_count += 1
-                print(f"Processing dialog: {dialog.name}")
-                
-                message_count = 0
-                async for message in self.client.iter_messages(dialog, limit=limit):
-                    if message.text:
-                        message_count += 1
-                        sender = await message.get_sender()
-                        sender_name = sender.first_name if hasattr(sender, 'first_name') else dialog.name
-                        messages.append({
-                            "id": f"telegram_{message.id}_{dialog.id}",
-                            "platform": "telegram",
-                            "title": f"Message from {sender_name}",
-                            "content": message.text,
-                            "sender": sender_name,
-                            "chat": dialog.name,
-                            "timestamp": message.date.isoformat(),
-                            "url": ""
-                        })
-                
-                print(f"Found {message_count} messages in {dialog.name}")
-                
-                # Limit to first few dialogs to avoid timeout
-                if dialog_count >= 5:
-                    break
+            for dialog, result in zip(selected, results):
+                if isinstance(result, Exception):
+                    print(f"⚠️  Error scanning {dialog.name}: {result}")
+                    continue
+                dialog_messages, cursor = result
+                if cursor:
+                    dialog_cursors[dialog.id] = cursor
+                messages.extend(dialog_messages)
+                print(f"Found {len(dialog_messages)} messages in {dialog.name}")
             
-            print(f"✅ Total Telegram messages fetched: {len(messages)}")
+            messages.sort(key=lambda m: m['timestamp'], reverse=True)
+            
+            fetched = messages
+            messages = sync_state.merge(None, 'telegram', fetched, dialog_cursors, budget)
+            # Gap fills can exceed the budget: keep the rest searchable in the store
+            returned_ids = {msg['id'] for msg in messages}
+            overflow = [msg for msg in fetched if msg['id'] not in returned_ids]
+            if overflow:
+                await asyncio.to_thread(message_store.upsert_messages, overflow)
+            print(f"✅ Total Telegram messages fetched: {len(messages)} ({len(overflow)} more stored)")
+            
+            # Seed the live buffer; from now on the update handler keeps it current
+            for msg in sorted(messages, key=lambda m: m['timestamp']):
+                self._buffer_message(msg, self._dialog_of(msg['id']))
+            self.primed = True
             
         except Exception as e:
             print(f"❌ Error in fetch_messages_async: {e}")
             import traceback
             traceback.print_exc()
-        finally:
-            await self.client.disconnect()
             
         return messages
+    
+    @staticmethod
+    def _select_dialogs(dialogs, dialog_cursors: Dict[int, int]) -> list:
+        """
+        Dialogs worth scanning: ones whose newest message is past our cursor,
+        unread ones first, then by last-message date.
+        """
+        def needs_scan(dialog) -> bool:
+            last_id, backfill = TelegramService._cursor_parts(dialog_cursors.get(dialog.id))
+            return backfill is not None or (dialog.message is not None and dialog.message.id > last_id)
+        
+        active = [dialog for dialog in dialogs if needs_scan(dialog)]
+        active.sort(
+            key=lambda d: (d.unread_count > 0, d.date or datetime.min.replace(tzinfo=timezone.utc)),
+            reverse=True
+        )
+        return active[:TELEGRAM_MAX_DIALOGS]
+    
+    @staticmethod
+    def _split_budget(dialogs, budget: int, per_dialog_cap: int) -> List[int]:
+        """Share the message budget by unread count (at least one message each)"""
+        weights = [dialog.unread_count + 1 for dialog in dialogs]
+        total = sum(weights) or 1
+        return [
+            max(1, min(per_dialog_cap, round(budget * weight / total)))
+            for weight in weights
+        ]
+    
+    @staticmethod
+    def _cursor_parts(cursor) -> Tuple[int, Optional[List[int]]]:
+        """(last message id, pending backfill window) of a dialog cursor"""
+        if isinstance(cursor, dict):
+            return cursor.get('id', 0), cursor.get('backfill')
+        return cursor or 0, None
+    
+    async def _sync_dialog(self, dialog, budget: int, cursor, semaphore: asyncio.Semaphore):
+        """
+        Messages of one dialog and its next cursor.
+        The cursor only moves past messages that were actually read: a scan
+        cut off by TELEGRAM_SYNC_MAX_MESSAGES is remembered as 'backfill'
+        (min_id, max_id) and read on the following syncs.
+        """
+        last_id, backfill = self._cursor_parts(cursor)
+        async with semaphore:
+            if not last_id:
+                # First sync: the latest `budget` messages, there is no gap to cover
+                messages, newest, _, _ = await self._scan_dialog(dialog, budget)
+                return messages, newest
+            
+            messages, newest, oldest, complete = await self._scan_dialog(
+                dialog, TELEGRAM_SYNC_MAX_MESSAGES, min_id=last_id
+            )
+            gap = None
+            if backfill:
+                older, _, older_oldest, done = await self._scan_dialog(
+                    dialog, TELEGRAM_SYNC_MAX_MESSAGES, min_id=backfill[0], max_id=backfill[1]
+                )
+                messages.extend(older)
+                if not done:
+                    gap = [backfill[0], older_oldest]
+            if not complete:
+                # Only the newest messages were read: (last_id, oldest read) is still missing
+                gap = [gap[0] if gap else last_id, oldest]
+        
+        newest = max(newest, last_id)
+        return messages, {'id': newest, 'backfill': gap} if gap else newest
+    
+    async def _scan_dialog(self, dialog, limit: int, min_id: int = 0, max_id: int = 0):
+        """
+        Up to `limit` messages between min_id and max_id (exclusive), newest
+        first; returns (messages, newest id, oldest id, reached min_id)
+        """
+        messages = []
+        newest, oldest, count = 0, 0, 0
+        async for message in self.client.iter_messages(dialog, limit=limit, min_id=min_id, max_id=max_id):
+            count += 1
+            newest = max(newest, message.id)
+            oldest = message.id
+            if message.text:
+                messages.append(await self._normalize(message, dialog.id, dialog.name))
+        return messages, newest, oldest, count < limit
+    
+    async def _normalize(self, message, dialog_id: int, chat_name: str) -> Dict[str, Any]:
+        """Telegram message -> aggregator message dict"""
+        sender_name = await self._sender_name(message, chat_name)
+        return {
+            "id": f"telegram_{message.id}_{dialog_id}",
+            "platform": "telegram",
+            "title": f"Message from {sender_name}",
+            "content": message.text,
+            "sender": sender_name,
+            "chat": chat_name,
+            "timestamp": message.date.isoformat(),
+            "url": ""
+        }
+    
+    async def _on_new_message(self, event):
+        """NewMessage update handler"""
+        try:
+            if not event.message.text:
+                return
+            chat = await event.get_chat()
+            msg = await self._normalize(event.message, event.chat_id, utils.get_display_name(chat))
+            self._buffer_message(msg, event.chat_id)
+            if TELEGRAM_PERSIST_UPDATES:
+                self._queue_store(msg)
+            else:
+                push_hub.publish_messages([msg])
+        except Exception as e:
+            print(f"❌ Error handling Telegram update: {e}")
+    
+    @staticmethod
+    def _dialog_of(msg_id: str) -> int:
+        """Dialog id encoded in a telegram_<message id>_<dialog id> message id"""
+        return int(msg_id.rsplit('_', 1)[1])
+    
+    def _buffer_message(self, msg: Dict[str, Any], dialog_id: int):
+        if msg['id'] in self._buffer:
+            self._buffer[msg['id']] = msg
+            return
+        
+        dialog_ids = self._dialog_buffers.get(dialog_id)
+        if dialog_ids and len(dialog_ids) >= TELEGRAM_BUFFER_PER_DIALOG:
+            self._evict(dialog_ids[0])
+        self._dialog_buffers.setdefault(dialog_id, deque()).append(msg['id'])
+        
+        self._buffer[msg['id']] = msg
+        while len(self._buffer) > TELEGRAM_BUFFER_TOTAL:
+            self._evict(next(iter(self._buffer)))
+    
+    def _evict(self, msg_id: str):
+        """Drop a message from the buffer and from its dialog's id list"""
+        self._buffer.pop(msg_id, None)
+        dialog_id = self._dialog_of(msg_id)
+        dialog_ids = self._dialog_buffers.get(dialog_id)
+        if not dialog_ids:
+            return
+        if dialog_ids[0] == msg_id:
+            dialog_ids.popleft()
+        else:
+            try:
+                dialog_ids.remove(msg_id)
+            except ValueError:
+                pass
+        if not dialog_ids:
+            del self._dialog_buffers[dialog_id]
+    
+    def buffered_messages(self, limit: int) -> List[Dict[str, Any]]:
+        """Newest `limit` buffered messages, newest first"""
+        messages = []
+        for msg_id in reversed(self._buffer):
+            if len(messages) >= limit:
+                break
+            messages.append(self._buffer[msg_id])
+        return messages
+    
+    def _queue_store(self, msg: Dict[str, Any]):
+        """Batch live messages into one store write per second"""
+        self._pending_store.append(msg)
+        if self._store_flush is None:
+            self._store_flush = asyncio.create_task(self._flush_store(delay=1.0))
+    
+    async def _flush_store(self, delay: float = 0):
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                pending, self._pending_store = self._pending_store, []
+                if not pending:
+                    return
+                try:
+                    new_messages = await asyncio.to_thread(message_store.upsert_new_messages, pending)
+                except Exception as e:
+                    print(f"⚠️  Error storing Telegram updates: {e}")
+                    continue
+                push_hub.publish_messages(new_messages)
+        finally:
+            self._store_flush = None
+    
+    async def close(self):
+        """Write queued updates and disconnect (call from app shutdown)"""
+        if self._store_flush is not None:
+            try:
+                await self._store_flush
+            except Exception as e:
+                print(f"⚠️  Error flushing Telegram updates: {e}")
+        if self.client.is_connected():
+            await self.client.disconnect()
+
+# Global instance
+_telegram_service = None
+
+async def get_telegram_service() -> TelegramService:
+    """Get or create the connected Telegram service instance"""
+    global _telegram_service
+    if _telegram_service is None:
+        _telegram_service = TelegramService()
+        await _telegram_service.ensure_connected()
+    return _telegram_service
+
+async def close_telegram_service():
+    if _telegram_service is not None:
+        await _telegram_service.close()
 
-async def fetch_telegram_messages_async(limit: int = 20) -> List[Dict[str, Any]]:
-    print(f"fetch_telegram_messages_async called with limit={limit}")
+async def fetch_telegram_messages(limit: int = 20) -> List[Dict[str, Any]]:
+    """Standalone function to fetch Telegram messages over the shared connection"""
+    print(f"fetch_telegram_messages called with limit={limit}")
     
     try:
-        service = TelegramService()
-        messages = await service.fetch_messages_async(limit)
+        service = await get_telegram_service()
+        if service.primed and service.client.is_connected():
+            # Kept current by the update handler: no upstream call
+            messages = service.buffered_messages(limit * 5)
+        else:
+            messages = await service.fetch_messages_async(limit)
         print(f"Returning {len(messages)} messages")
         return messages
-    except Exception as e:
-        print(f"❌ Error in fetch_telegram_messages_async: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
-
-def fetch_telegram_messages(limit: int = 20) -> List[Dict[str, Any]]:
-    """Synchronous wrapper for thread pool execution"""
-    try:
-        # ✅ FIX: Create a new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            return loop.run_until_complete(fetch_telegram_messages_async(limit))
-        finally:
-            loop.close()
     except Exception as e:
         print(f"❌ Error in fetch_telegram_messages: {e}")
         import traceback
         traceback.print_exc()
-        return []
\ No newline at end of file
+        return []
@@ -1,44 +1,143 @@
-from typing import List, Dict, Any
-import requests
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import httpx
 import os
+from app.services.sync_state import sync_state
 
 BEARER_TOKEN = os.getenv("TWITTER_BEARER_TOKEN")
 
+SEARCH_URL = "https://api.twitter.com/2/tweets/search/recent"
+# Recent search accepts 10-100 results per page
+MIN_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+MAX_PAGES = int(os.getenv('TWITTER_MAX_PAGES', '5'))
+# Keywords whose since_id cursor is kept (least recently searched are forgotten)
+TWITTER_MAX_CURSORS = int(os.getenv('TWITTER_MAX_CURSORS', '100'))
+
+TWITTER_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+TWITTER_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+
+# Shared pooled client (created on first use inside the app's event loop)
+_client: Optional[httpx.AsyncClient] = None
+# sync_state sources of recent keyword searches, least recently used first
+_cursor_sources: "OrderedDict[str, None]" = OrderedDict()
+
 def create_headers(token):
     return {"Authorization": f"Bearer {token}"}
 
-def search_tweets(keyword: str, max_results: int = 10):
-    url = "https://api.twitter.com/2/tweets/search/recent"
-    headers = create_headers(BEARER_TOKEN)
-    params = {
-        "query": keyword,
-        "max_results": max_results,
-        "tweet.fields": "author_id,created_at,public_metrics,entities",
-    }
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code != 200:
-        return []
-    return response.json().get("data", [])
+def get_twitter_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers=create_headers(BEARER_TOKEN),
+            timeout=TWITTER_TIMEOUT,
+            limits=TWITTER_LIMITS
+        )
+    return _client
 
-def fetch_twitter_messages(keyword: str = "python", max_results: int = 1) -> List[Dict[str, Any]]:
-    tweets = search_tweets(keyword, max_results)
-    messages = []
+async def close_twitter_client():
+    """Close the shared HTTP client (call from app shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def search_tweets(
+    keyword: str,
+    max_results: int = 10,
+    since_id: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]], Optional[str]]:
+    """
+    Recent tweets for keyword (newest first), paging with next_token until
+    max_results are collected. Returns (tweets, users by id, newest id).
+    """
+    client = get_twitter_client()
+    tweets = []
+    users = {}
+    newest_id = None
+    next_token = None
     
+    for _ in range(MAX_PAGES):
+        params = {
+            "query": keyword,
+            "max_results": max(MIN_PAGE_SIZE, min(MAX_PAGE_SIZE, max_results - len(tweets))),
+            "tweet.fields": "author_id,created_at,public_metrics,entities",
+            # Resolve authors in the same call
+            "expansions": "author_id",
+            "user.fields": "name,username",
+        }
+        if since_id:
+            params["since_id"] = since_id
+        if next_token:
+            params["next_token"] = next_token
+        
+        response = await client.get(SEARCH_URL, params=params)
+        if response.status_code != 200:
+            print(f"⚠️  Twitter search failed ({response.status_code}): {response.text[:200]}")
+            break
+        
+        body = response.json()
+        meta = body.get("meta", {})
+        # The first page holds the newest tweet
+        newest_id = newest_id or meta.get("newest_id")
+        tweets.extend(body.get("data", []))
+        for user in body.get("includes", {}).get("users", []):
+            users[user["id"]] = user
+        
+        next_token = meta.get("next_token")
+        if not next_token or len(tweets) >= max_results:
+            break
+    
+    return tweets[:max_results], users, newest_id
+
+def _cursor_source(keyword: str) -> str:
+    """
+    sync_state source for a keyword. Keywords come from requests, so only
+    the TWITTER_MAX_CURSORS most recently searched keep their cursor.
+    """
+    source = f"twitter:{keyword.strip().lower()}"
+    _cursor_sources[source] = None
+    _cursor_sources.move_to_end(source)
+    while len(_cursor_sources) > TWITTER_MAX_CURSORS:
+        evicted, _ = _cursor_sources.popitem(last=False)
+        sync_state.forget(None, evicted)
+    return source
+
+async def fetch_twitter_messages(keyword: str = "python", max_results: int = 10) -> List[Dict[str, Any]]:
+    """
+    Tweets matching keyword. Repeat searches for the same keyword only ask
+    for tweets newer than the last one seen (since_id).
+    """
+    if not BEARER_TOKEN:
+        print("⚠️  Twitter bearer token not configured")
+        return []
+    
+    source = _cursor_source(keyword)
+    try:
+        since_id = sync_state.get_cursor(None, source)
+        tweets, users, newest_id = await search_tweets(keyword, max_results, since_id)
+    except httpx.HTTPError as e:
+        print(f"❌ Twitter fetch error: {e}")
+        return []
+    
+    messages = []
     for tweet in tweets:
         entities = tweet.get("entities", {})
         mentions = [m["username"] for m in entities.get("mentions", [])]
         hashtags = [h["tag"] for h in entities.get("hashtags", [])]
         urls = [u["expanded_url"] for u in entities.get("urls", [])]
+        author = users.get(tweet.get("author_id"), {})
         
         messages.append({
             "id": f"twitter_{tweet['id']}",
             "platform": "twitter",
             "title": f"Tweet about {keyword}",
             "content": tweet["text"],
+            "sender": author.get("name") or (f"@{author['username']}" if author.get("username") else "unknown"),
             "mentions": mentions,
             "hashtags": hashtags,
             "timestamp": tweet.get("created_at", ""),
             "url": urls[0] if urls else ""
         })
     
-    return messages
\ No newline at end of file
+    return sync_state.merge(None, source, messages, newest_id or since_id, max_results)
@@ -0,0 +1,170 @@
+from typing import List, Dict, Any, Optional, Callable
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+import os
+
+CURATION_WORKERS = int(os.getenv('CURATION_WORKERS', '2'))
+CURATION_MAX_PENDING = int(os.getenv('CURATION_MAX_PENDING', '32'))
+# Seconds between model state checks while workers are still loading the model
+CURATION_STATUS_POLL = float(os.getenv('CURATION_STATUS_POLL', '2'))
+
+
+class WorkerPoolBusy(Exception):
+    """Raised when the curation queue is full; callers should shed load (HTTP 503)"""
+
+
+# ---------------------------------------------------------------------------
+# Worker-side functions: run inside the pool processes, must be module level
+# ---------------------------------------------------------------------------
+
+def _init_worker():
+    """
+    Warm the sentence model in the background of each worker process.
+    Workers are spawned on demand, so loading here synchronously would make
+    the request that spawned one wait for the model; until it is ready the
+    curator scores with keywords/TF-IDF only.
+    """
+    from app.services.curation.sentence_transformer_curator import sentence_curator
+    from app.services.date_extractor import date_extractor  # noqa: F401 (warm dateparser import)
+
+    sentence_curator.start_background_load()
+
+
+def worker_status() -> Dict[str, Any]:
+    """Model state as seen from inside a worker"""
+    from app.services.curation.sentence_transformer_curator import sentence_curator
+    return {'pid': os.getpid(), **sentence_curator.status()}
+
+
+def run_curation(
+    messages: List[Dict[str, Any]],
+    preferences: List[str],
+    filter_by_preferences: bool
+) -> Dict[str, Any]:
+    """Preference filtering + hybrid curation for one feed request"""
+    from app.services.message_filter import MessageFilter
+    from app.services.curation.hybrid_curator import hybrid_curator
+
+    features = None
+    if filter_by_preferences and preferences:
+        print(f"🔍 Applying preference filter with {len(preferences)} preferences")
+        mf = MessageFilter()
+        # Score each message once; the curator reuses these records
+        features = mf.extract_features(messages, preferences)
+        ranked = mf.rank_features(features, threshold=0.15, top_k=None)
+        features = ranked['important'] + ranked['regular']
+        messages = [f.message for f in features]
+        print(f"✅ After filtering: {len(messages)} messages")
+
+    print("🎨 Starting message curation...")
+    curated_result = hybrid_curator.curate_messages(
+        messages,
+        preferences or [],
+        features=features
+    )
+    curated_result['total_count'] = len(messages)
+    return curated_result
+
+
+def extract_dates_and_times(text: str) -> List[Dict[str, Any]]:
+    """Date/time extraction (dateparser is CPU-bound)"""
+    from app.services.date_extractor import date_extractor
+    return date_extractor.extract_dates_and_times(text)
+
+
+# ---------------------------------------------------------------------------
+# Event-loop side
+# ---------------------------------------------------------------------------
+
+class CurationWorkerPool:
+    """
+    Process pool for CPU-bound work (curation, TF-IDF, date extraction).
+    The event loop only submits and awaits; queue depth is bounded and
+    cancelling the awaiting request drops work that hasn't started yet.
+    """
+
+    def __init__(self, max_workers: int = CURATION_WORKERS, max_pending: int = CURATION_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.ready = False
+        self.worker_model_status: Optional[Dict[str, Any]] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Start worker processes (call from app startup)"""
+        if self._executor is not None or self.max_workers <= 0:
+            return
+
+        # spawn: torch and fork don't mix
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+        self._warmup_task = asyncio.create_task(self._warm_up())
+        print(f"✅ Curation worker pool started with {self.max_workers} workers")
+
+    async def _warm_up(self):
+        """Start a worker, then follow its model load until it settles"""
+        try:
+            while True:
+                self.worker_model_status = await self.run(worker_status)
+                state = self.worker_model_status.get('state')
+                if not self.ready:
+                    self.ready = True
+                    print(f"✅ Curation workers ready (model: {state})")
+                if state in ('ready', 'failed'):
+                    print(f"✅ Curation worker model {state}")
+                    return
+                await asyncio.sleep(CURATION_STATUS_POLL)
+        except Exception as e:
+            print(f"❌ Curation worker warm-up failed: {e}")
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """
+        Run fn(*args) in a worker process.
+        Without a running pool (e.g. scripts, CURATION_WORKERS=0) it runs in a
+        thread instead, which still keeps the event loop free.
+        """
+        if self.pending >= self.max_pending:
+            raise WorkerPoolBusy(f"Curation queue full ({self.pending} pending)")
+
+        self.pending += 1
+        try:
+            if self._executor is None:
+                return await asyncio.to_thread(fn, *args)
+            loop = asyncio.get_running_loop()
+            # Cancelling this await cancels the pool future if it hasn't started
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'ready': self.ready,
+            'workers': self.max_workers if self.enabled else 0,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'worker_model': self.worker_model_status
+        }
+
+    def shutdown(self):
+        """Stop workers, dropping queued work (call from app shutdown)"""
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.ready = False
+
+
+# Singleton instance
+curation_pool = CurationWorkerPool()
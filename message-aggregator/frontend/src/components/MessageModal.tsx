@@ -12,6 +12,7 @@ interface Message {
   timestamp: string;
   chat?: string;
   url?: string;
+  body_loaded?: boolean;
   ai_scores?: {
     semantic_score?: number;
     keyword_score?: number;
@@ -40,18 +41,39 @@ const MessageModal: React.FC<MessageModalProps> = ({ message, onClose }) => {
   const [savingEvent, setSavingEvent] = useState<number | null>(null);
   const [isSaved, setIsSaved] = useState(false); // ✅ Add this
   const [savingMessage, setSavingMessage] = useState(false); // ✅ Add this
+  const [content, setContent] = useState(message.content);
   const { user, getToken } = useAuth();
 
   useEffect(() => {
-    extractDatesFromMessage();
+    loadContent().then(extractDatesFromMessage);
     checkIfMessageSaved();
   }, [message]);
 
-  const extractDatesFromMessage = async () => {
+  // Gmail messages arrive with only a snippet; fetch the full body on open
+  const loadContent = async (): Promise<string> => {
+    setContent(message.content);
+    if (message.platform !== "gmail" || message.body_loaded !== false || !user) {
+      return message.content;
+    }
+    try {
+      const token = await getToken();
+      const response = await axios.get(
+        `http://localhost:8000/messages/gmail/${message.id}/body`,
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
+      setContent(response.data.content);
+      return response.data.content;
+    } catch (error) {
+      console.error("Error loading Gmail body:", error);
+      return message.content;
+    }
+  };
+
+  const extractDatesFromMessage = async (text: string) => {
     try {
       setLoadingDates(true);
       const response = await axios.post("http://localhost:8000/extract-dates", {
-        text: message.content,
+        text,
         title: message.title,
       });
 
@@ -143,7 +165,7 @@ const MessageModal: React.FC<MessageModalProps> = ({ message, onClose }) => {
 
       const eventData = {
         title: message.title || "Event from message",
-        description: event.context || message.content.substring(0, 200),
+        description: event.context || content.substring(0, 200),
         date: event.date,
         time: event.time || "",
         platform: message.platform,
@@ -455,7 +477,7 @@ const MessageModal: React.FC<MessageModalProps> = ({ message, onClose }) => {
               lineHeight: "1.6",
             }}
           >
-            {message.content}
+            {content}
           </div>
         </div>
 